@@ -7,6 +7,7 @@ sys.path.append(os.path.join(os.path.dirname(__file__), 'backend'))
 from database import SessionLocal
 import crud
 import schemas
+from celery_app import queue_template_analysis
 
 def add_template():
     db = SessionLocal()
@@ -36,6 +37,8 @@ def add_template():
         )
         
         created = crud.create_template(db, t)
+        # Precompute its face index now rather than on the first swap
+        queue_template_analysis(created.id)
         print(f"Successfully added template: {created.title} (ID: {created.id})")
 
     except Exception as e:
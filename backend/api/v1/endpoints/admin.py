@@ -0,0 +1,10 @@
+from fastapi import APIRouter, Depends
+from fastapi.concurrency import run_in_threadpool
+import schemas, auth
+import result_cache
+
+router = APIRouter()
+
+@router.get("/cache/stats", response_model=dict)
+async def get_result_cache_stats(current_user: schemas.UserIdentity = Depends(auth.get_admin_user)):
+    return await run_in_threadpool(result_cache.stats)
@@ -86,7 +86,7 @@ def verify_payment(
              return {"status": "already_processed"}
 
         # Success! Add Gems
-        crud.update_user_gems(db, current_user.id, verification.gems)
+        new_balance = crud.update_user_gems(db, current_user.id, verification.gems)
         
         # Record transaction (Reusing stripe_id field for razorpay_payment_id for now)
         new_tx = models.Transaction(
@@ -99,7 +99,7 @@ def verify_payment(
         db.add(new_tx)
         db.commit()
         
-        return {"status": "success", "new_balance": current_user.gem_balance + verification.gems} # Approximate, or re-fetch
+        return {"status": "success", "new_balance": new_balance}
 
     except Exception as e:
         print(f"Payment verification failed: {e}")
@@ -1,42 +1,166 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, Request, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-import crud, schemas, auth, models
-from database import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+import crud, crud_async, schemas, auth, models
+import result_cache
+import progress
+import json
+import upload_stream
+from database import get_db, get_async_db
 from celery_app import celery_app
-import shutil
-import os
 import uuid
+from contextlib import aclosing
+from datetime import datetime
 
 router = APIRouter()
 
 @router.post("/upload", response_model=dict)
-def upload_file(
-    file: UploadFile = File(...),
-    current_user: models.User = Depends(auth.get_current_user)
+async def upload_file(
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: schemas.UserIdentity = Depends(auth.get_current_user_cached)
+):
+    """
+    Streams a multipart "file" field straight to storage as it arrives: no temp
+    file, no full copy in memory. The first bytes must be a JPEG, PNG, GIF or WebP
+    image and the file may not exceed MAX_UPLOAD_BYTES.
+    """
+    content_length = int(request.headers.get("content-length") or 0)
+    # Allow some room for the multipart framing around the file
+    if content_length > upload_stream.MAX_UPLOAD_BYTES + 64 * 1024:
+        raise HTTPException(413, detail="File too large")
+
+    import storage
+    try:
+        upload = upload_stream.FileFieldStream(request.headers.get("content-type"), request.stream())
+        file_ext, content_type = await upload.start()
+        path = f"uploads/{uuid.uuid4()}.{file_ext}"
+        public_url = await storage.upload_stream(upload, "faceswap", path, content_type)
+    except upload_stream.UploadError as e:
+        raise HTTPException(e.status_code, detail=e.detail)
+
+    if not public_url:
+        raise HTTPException(500, detail="Failed to upload file to storage")
+
+    # Lets a resubmission of the same image be answered from the result cache
+    await run_in_threadpool(result_cache.record_content_hash, public_url, upload.sha256)
+
+    db_upload = await crud_async.create_upload(
+        db, current_user.id, "faceswap", path, public_url, content_type,
+        models.UploadStatus.UPLOADED, upload.sha256
+    )
+    # Analyze the source face while the user picks a template
+    # (publishing to the broker is a blocking call)
+    await run_in_threadpool(celery_app.send_task, "preprocess_upload_task", args=[db_upload.id])
+
+    return {"url": public_url, "upload_id": db_upload.id}
+
+@router.post("/upload-url", response_model=schemas.UploadUrl)
+def create_upload_url(
+    request: schemas.UploadUrlRequest,
+    db: Session = Depends(get_db),
+    current_user: schemas.UserIdentity = Depends(auth.get_current_user_cached)
 ):
-    # Validate file type
-    if not file.content_type.startswith("image/"):
+    """
+    Short-lived signed URL for uploading an image straight to storage, bypassing the API.
+    The client PUTs the file to `upload_url`, then calls /uploads/{upload_id}/confirm.
+    """
+    file_ext = upload_stream.CONTENT_TYPE_EXTENSIONS.get(request.content_type)
+    if not file_ext:
         raise HTTPException(400, detail="Invalid file type. Only images are allowed.")
 
-    # Save file to temp then upload
-    file_ext = file.filename.split(".")[-1]
-    filename = f"{uuid.uuid4()}.{file_ext}"
-    temp_path = f"temp_{filename}"
-    
+    import storage
+    path = f"uploads/{uuid.uuid4()}.{file_ext}"
+    expires_in = upload_stream.UPLOAD_URL_EXPIRES_SECONDS
+    signed = storage.signed_upload("faceswap", path, request.content_type, expires_in)
+    if not signed:
+        raise HTTPException(500, detail="Failed to create upload URL")
+
+    url = storage.public_url("faceswap", path)
+    db_upload = crud.create_upload(db, current_user.id, "faceswap", path, url, request.content_type)
+    return schemas.UploadUrl(upload_id=db_upload.id, url=url, expires_in=expires_in, **signed)
+
+@router.put("/signed-upload/{bucket}/{path:path}", response_model=dict)
+async def signed_upload(bucket: str, path: str, expires: int, signature: str, request: Request,
+                        db: AsyncSession = Depends(get_async_db)):
+    """
+    Target of signed upload URLs for the local storage backend (Supabase serves its own).
+    The HMAC signature authorizes exactly one object path until `expires`, and
+    only until the upload is confirmed, so an accepted image cannot be replaced.
+    """
+    import storage
+    if storage.STORAGE_BACKEND != "local":
+        raise HTTPException(404, detail="Not found")
+    if not storage.verify_upload_signature(bucket, path, expires, signature):
+        raise HTTPException(403, detail="Invalid or expired upload URL")
+    db_upload = await crud_async.get_upload_by_url(db, storage.public_url(bucket, path))
+    if db_upload is None or db_upload.status != models.UploadStatus.PENDING:
+        raise HTTPException(409, detail="Upload already confirmed")
+
     try:
-        with open(temp_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-            
-        import storage
-        public_url = storage.upload_file(temp_path, "faceswap", f"uploads/{filename}")
-        
-        if not public_url:
-            raise HTTPException(500, detail="Failed to upload file to storage")
-            
-        return {"url": public_url}
-    finally:
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+        upload = upload_stream.RawImageStream(request.stream())
+        _, content_type = await upload.start()
+        url = await storage.upload_stream(upload, bucket, path, content_type)
+    except upload_stream.UploadError as e:
+        raise HTTPException(e.status_code, detail=e.detail)
+    if not url:
+        raise HTTPException(500, detail="Failed to upload file to storage")
+    return {"url": url}
+
+@router.post("/uploads/{upload_id}/confirm", response_model=dict)
+def confirm_upload(
+    upload_id: int,
+    db: Session = Depends(get_db),
+    current_user: schemas.UserIdentity = Depends(auth.get_current_user_cached)
+):
+    """
+    Checks that a direct upload landed and is an image, records it and starts preprocessing.
+    Returns the same {"url"} as /upload.
+    """
+    db_upload = crud.get_upload(db, upload_id)
+    if not db_upload or db_upload.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    if db_upload.status == models.UploadStatus.UPLOADED:
+        return {"url": db_upload.url, "upload_id": db_upload.id}
+    import storage
+    if (datetime.utcnow() - db_upload.created_at).total_seconds() > upload_stream.UPLOAD_URL_EXPIRES_SECONDS:
+        # Whatever was uploaded will never be confirmed
+        storage.delete_files(db_upload.bucket, [db_upload.path])
+        raise HTTPException(status_code=410, detail="Upload URL expired")
+
+    head = storage.head(db_upload.url, upload_stream.SNIFF_BYTES)
+    if head is None:
+        raise HTTPException(status_code=400, detail="File was not uploaded")
+    first_bytes, size = head
+    error = None
+    if upload_stream.sniff_image(first_bytes) is None:
+        error = HTTPException(400, detail="Invalid file type. Only images are allowed.")
+    elif size > upload_stream.MAX_UPLOAD_BYTES:
+        error = HTTPException(413, detail="File too large")
+    if error:
+        storage.delete_files(db_upload.bucket, [db_upload.path])
+        raise error
+
+    crud.update_upload(db, upload_id, status=models.UploadStatus.UPLOADED)
+    # Analyze the source face while the user picks a template
+    celery_app.send_task("preprocess_upload_task", args=[upload_id])
+    return {"url": db_upload.url, "upload_id": upload_id}
+
+@router.get("/uploads/{upload_id}", response_model=schemas.Upload)
+async def get_upload(
+    upload_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: schemas.UserIdentity = Depends(auth.get_current_user_cached)
+):
+    """
+    Upload state, including whether a face was found in it (face_status).
+    """
+    db_upload = await crud_async.get_upload(db, upload_id)
+    if not db_upload or db_upload.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return db_upload
 
 @router.post("/", response_model=schemas.SwapTask)
 def create_swap(
@@ -44,38 +168,101 @@ def create_swap(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
-    # Check gem balance
     cost = 1 if task.type == models.TaskType.IMAGE else 10
-    if current_user.gem_balance < cost:
-        raise HTTPException(status_code=402, detail="Insufficient gems")
 
-    # Deduct gems
-    crud.update_user_gems(db, current_user.id, -cost)
+    # The source was analyzed at upload time: fail before spending gems if it has no face
+    source_upload = crud.get_user_upload_by_url(db, current_user.id, task.source_url)
+    if source_upload is not None and source_upload.face_status == models.FaceStatus.NOT_FOUND:
+        raise HTTPException(status_code=422, detail="No face detected in source image")
 
-    # Create task
-    db_task = crud.create_swap_task(db, current_user.id, task, cost)
+    # Same source and template content as an earlier swap: the task is created already completed
+    result_url = result_cache.lookup_urls(task.source_url, task.template_url)
+    status = models.TaskStatus.COMPLETED if result_url else models.TaskStatus.PENDING
 
-    # Trigger Celery task
-    celery_app.send_task("process_swap_task", args=[db_task.id])
+    # Deduct gems and create the task in one transaction
+    db_task, _ = crud.debit_and_create_swap_task(db, current_user.id, task, cost, status, result_url)
+    if db_task is None:
+        raise HTTPException(status_code=402, detail="Insufficient gems")
+
+    # Trigger Celery task (only once the task is committed, so the worker can see it)
+    if not result_url:
+        celery_app.send_task("process_swap_task", args=[db_task.id])
 
     return db_task
 
-@router.get("/history", response_model=list[schemas.SwapTask])
-def get_history(
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+@router.get("/history", response_model=schemas.SwapTaskPage)
+async def get_history(
+    limit: int = Query(20, ge=1, le=100),
+    cursor: str = None,
+    status: models.TaskStatus = None,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: schemas.UserIdentity = Depends(auth.get_current_user_cached)
 ):
-    return crud.get_user_tasks(db, current_user.id)
+    """
+    The user's tasks, newest first. Pass `next_cursor` back as `cursor` for the next page.
+    """
+    try:
+        tasks, next_cursor = await crud_async.get_user_tasks_page(db, current_user.id, limit, cursor, status)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"items": tasks, "next_cursor": next_cursor}
 
 @router.get("/{task_id}", response_model=schemas.SwapTask)
-def get_swap_status(
+async def get_swap_status(
     task_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: schemas.UserIdentity = Depends(auth.get_current_user_cached)
 ):
-    task = crud.get_swap_task(db, task_id)
+    task = await crud_async.get_swap_task(db, task_id)
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
     if task.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized to view this task")
     return task
+
+@router.get("/{task_id}/events")
+async def stream_swap_events(
+    task_id: int,
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: schemas.UserIdentity = Depends(auth.get_current_user_cached)
+):
+    """
+    Server-sent events with the task's status and progress, as published by
+    the worker: {"task_id", "status", "progress", "result_url", "error_message"}.
+    Postgres is only queried once, when the stream is opened; the stream ends
+    when the task completes or fails.
+    """
+    task = await crud_async.get_swap_task(db, task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if task.user_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Not authorized to view this task")
+    initial = {
+        "task_id": task.id,
+        "status": task.status.value,
+        "progress": None,
+        "result_url": task.result_url,
+        "error_message": task.error_message,
+    }
+    # Nothing else needs the database: release the connection for the life of the stream
+    await db.close()
+
+    async def events():
+        yield f"data: {json.dumps(initial)}\n\n"
+        if initial["status"] in progress.TERMINAL_STATUSES:
+            return
+        async with aclosing(progress.subscribe(task_id)) as stream:
+            async for event in stream:
+                if await request.is_disconnected():
+                    return
+                if event is None:
+                    yield ": keep-alive\n\n"
+                else:
+                    yield f"data: {json.dumps(event)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        # Don't let a reverse proxy hold events back
+        "X-Accel-Buffering": "no",
+    })
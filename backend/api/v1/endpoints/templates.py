@@ -1,23 +1,46 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
-import crud, models, schemas
-from database import get_db
+import crud, crud_async, models, schemas
+import catalogue_cache
+import json
+from database import get_db, get_async_db
+from celery_app import queue_template_analysis
 
 router = APIRouter()
 
 @router.get("/", response_model=List[schemas.Template])
-def read_templates(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    templates = crud.get_templates(db, skip=skip, limit=limit)
-    return templates
+async def read_templates(request: Request, skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_async_db)):
+    """
+    Served from catalogue_cache: no database query unless a template was
+    added, and 304 Not Modified when the client's ETag still matches.
+    """
+    entry = catalogue_cache.get_local(skip, limit)
+    if entry is None:
+        entry, generation = await run_in_threadpool(catalogue_cache.get, skip, limit)
+        if entry is None:
+            templates = await crud_async.get_templates(db, skip=skip, limit=limit)
+            body = json.dumps([schemas.Template.model_validate(t).model_dump(mode="json") for t in templates]).encode()
+            entry = await run_in_threadpool(catalogue_cache.store, skip, limit, body, generation)
+
+    body, etag = entry
+    headers = {"ETag": etag, "Cache-Control": catalogue_cache.cache_control()}
+    if catalogue_cache.etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 @router.get("/{template_id}", response_model=schemas.Template)
-def read_template(template_id: int, db: Session = Depends(get_db)):
-    template = crud.get_template(db, template_id=template_id)
+async def read_template(template_id: int, db: AsyncSession = Depends(get_async_db)):
+    template = await crud_async.get_template(db, template_id=template_id)
     if not template:
         raise HTTPException(status_code=404, detail="Template not found")
     return template
 
 @router.post("/", response_model=schemas.Template)
 def create_template(template: schemas.TemplateCreate, db: Session = Depends(get_db)):
-    return crud.create_template(db=db, template=template)
+    db_template = crud.create_template(db=db, template=template)
+    # Precompute the per-frame face index once so swaps against this template skip detection
+    queue_template_analysis(db_template.id)
+    return db_template
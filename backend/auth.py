@@ -1,48 +1,281 @@
 from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
-from database import get_db
-import crud, models, schemas
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_db, get_async_db
+import crud, crud_async, models, schemas
 import os
+import time
+import threading
+from collections import OrderedDict
 import jwt
 # from clerk_backend_api import Clerk # Optional if using SDK for other things
 
 security = HTTPBearer()
 
-def get_current_user(
-    token: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
-):
+# e.g. https://<your-app>.clerk.accounts.dev/.well-known/jwks.json
+# Without it token signatures are NOT verified (local development only)
+CLERK_JWKS_URL = os.getenv("CLERK_JWKS_URL")
+JWKS_REFRESH_SECONDS = int(os.getenv("JWKS_REFRESH_SECONDS", "3600"))
+# Unknown key ids trigger a refresh, at most this often
+JWKS_MIN_REFRESH_SECONDS = 30
+# How long a request with an unknown key id waits for that refresh
+JWKS_WAIT_SECONDS = 5
+
+# Comma-separated Clerk user ids allowed on /api/v1/admin routes
+ADMIN_CLERK_IDS = {clerk_id.strip() for clerk_id in os.getenv("ADMIN_CLERK_IDS", "").split(",") if clerk_id.strip()}
+
+# Per-process cache of clerk_id -> user identity for read endpoints
+AUTH_USER_CACHE_TTL = float(os.getenv("AUTH_USER_CACHE_TTL", "300"))
+AUTH_USER_CACHE_SIZE = int(os.getenv("AUTH_USER_CACHE_SIZE", "10000"))
+
+
+class JWKSCache:
+    """
+    Clerk's signing keys by key id. Only the background thread fetches them:
+    once at startup, then every JWKS_REFRESH_SECONDS, and early when a token
+    names a key we don't have (e.g. after a key rotation). Requests never
+    make the HTTP call themselves.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.keys = {}
+        self.fetched_at = 0.0
+        self.attempted_at = 0.0
+        self.attempts = 0
+        self.wake = threading.Event()
+        self.done = threading.Condition()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._refresh_loop, daemon=True, name="jwks-refresh")
+            self.thread.start()
+
+    def refresh(self):
+        import storage
+        response = storage.http_session().get(self.url, timeout=storage.timeout())
+        response.raise_for_status()
+        keys = {}
+        for jwk in response.json().get("keys", []):
+            if jwk.get("kty") == "RSA" and jwk.get("kid"):
+                keys[jwk["kid"]] = jwt.algorithms.RSAAlgorithm.from_jwk(jwk)
+        self.keys = keys
+        self.fetched_at = time.monotonic()
+
+    def _refresh_loop(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                # Keep verifying with the keys we have
+                print(f"JWKS refresh failed: {e}")
+            with self.done:
+                self.attempted_at = time.monotonic()
+                self.attempts += 1
+                self.done.notify_all()
+            self.wake.wait(JWKS_REFRESH_SECONDS)
+            self.wake.clear()
+
+    def known(self, kid):
+        return kid in self.keys
+
+    def get(self, kid):
+        """
+        The key for `kid`. An unknown kid asks the background thread for an
+        early refresh and waits up to JWKS_WAIT_SECONDS for it, so call this
+        off the event loop when known(kid) is False.
+        """
+        key = self.keys.get(kid)
+        if key is not None:
+            return key
+        self.start()
+        with self.done:
+            attempts = self.attempts
+            # The startup fetch is simply awaited; early refreshes are rate-limited
+            if attempts > 0:
+                if time.monotonic() - self.attempted_at < JWKS_MIN_REFRESH_SECONDS:
+                    return None
+                self.wake.set()
+            self.done.wait_for(lambda: self.attempts > attempts, timeout=JWKS_WAIT_SECONDS)
+        return self.keys.get(kid)
+
+
+class UserCache:
+    """
+    LRU of clerk_id -> schemas.UserIdentity, entries expire after AUTH_USER_CACHE_TTL seconds.
+    """
+
+    def __init__(self, ttl, size):
+        self.ttl = ttl
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, clerk_id):
+        with self.lock:
+            entry = self.entries.get(clerk_id)
+            if entry is None:
+                return None
+            identity, expires = entry
+            if time.monotonic() > expires:
+                del self.entries[clerk_id]
+                return None
+            self.entries.move_to_end(clerk_id)
+            return identity
+
+    def put(self, identity):
+        if self.size <= 0:
+            return
+        with self.lock:
+            self.entries[identity.clerk_id] = (identity, time.monotonic() + self.ttl)
+            self.entries.move_to_end(identity.clerk_id)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+
+jwks = JWKSCache(CLERK_JWKS_URL) if CLERK_JWKS_URL else None
+user_cache = UserCache(AUTH_USER_CACHE_TTL, AUTH_USER_CACHE_SIZE)
+
+
+def start():
+    """
+    Prefetches the JWKS in the background (called at API startup).
+    """
+    if jwks is not None:
+        jwks.start()
+
+
+def decode_token(token: HTTPAuthorizationCredentials) -> dict:
+    """
+    Verified claims of a Clerk session token (unverified without CLERK_JWKS_URL).
+    """
     try:
-        # Decode the token (For MVP we skip signature verification to avoid JWKS fetching complexity)
-        # In PROD: Fetch JWKS from Clerk and verify signature!
-        payload = jwt.decode(token.credentials, options={"verify_signature": False})
+        if jwks is None:
+            payload = jwt.decode(token.credentials, options={"verify_signature": False})
+        else:
+            kid = jwt.get_unverified_header(token.credentials).get("kid")
+            key = jwks.get(kid)
+            if key is None:
+                raise jwt.InvalidTokenError("unknown signing key")
+            payload = jwt.decode(
+                token.credentials, key, algorithms=["RS256"],
+                leeway=5, options={"verify_aud": False},
+            )
         clerk_id = payload.get("sub")
         # email = payload.get("email") # specific claim depends on Clerk JWT template
-        
+
         if not clerk_id:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid token: no sub claim",
             )
-            
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=f"Invalid authentication credentials: {str(e)}",
         )
-    
-    user = crud.get_user_by_clerk_id(db, clerk_id=clerk_id)
+    return payload
+
+
+async def decode_token_async(token: HTTPAuthorizationCredentials) -> dict:
+    """
+    decode_token for async dependencies. Verification is CPU-only and runs
+    inline; a token with an unknown key id may wait for a JWKS refresh, so it
+    is decoded in the threadpool instead of blocking the event loop.
+    """
+    if jwks is not None:
+        try:
+            kid = jwt.get_unverified_header(token.credentials).get("kid")
+        except Exception:
+            kid = None
+        if not jwks.known(kid):
+            return await run_in_threadpool(decode_token, token)
+    return decode_token(token)
+
+
+def _new_user(payload: dict):
+    # Auto-register the user if they don't exist
+    # We might need an email. For now, checking if email is in payload or use dummy
+    clerk_id = payload["sub"]
+    email = payload.get("email", f"{clerk_id}@example.com")
+    # Note: You need to ensure your Clerk JWT template includes 'email'
+    return schemas.UserCreate(
+        email=email,
+        clerk_id=clerk_id
+    )
+
+
+def _load_user(db: Session, payload: dict):
+    user = crud.get_user_by_clerk_id(db, clerk_id=payload["sub"])
     if not user:
-        # Auto-register the user if they don't exist
-        # We might need an email. For now, checking if email is in payload or use dummy
-        email = payload.get("email", f"{clerk_id}@example.com") 
-        # Note: You need to ensure your Clerk JWT template includes 'email'
-        
-        user_create = schemas.UserCreate(
-            email=email,
-            clerk_id=clerk_id
-        )
-        user = crud.create_user(db=db, user=user_create)
+        user = crud.create_user(db=db, user=_new_user(payload))
+
+    user_cache.put(schemas.UserIdentity.model_validate(user))
+    return user
+
+
+async def _load_user_async(db: AsyncSession, payload: dict):
+    user = await crud_async.get_user_by_clerk_id(db, clerk_id=payload["sub"])
+    if not user:
+        user = await crud_async.create_user(db=db, user=_new_user(payload))
 
+    user_cache.put(schemas.UserIdentity.model_validate(user))
     return user
+
+
+def get_current_user(
+    token: HTTPAuthorizationCredentials = Depends(security),
+    db: Session = Depends(get_db)
+):
+    """
+    The user row, always read from the database. Use this where the gem
+    balance matters (swap submission, payments, balance display).
+    """
+    return _load_user(db, decode_token(token))
+
+
+async def get_current_user_async(
+    token: HTTPAuthorizationCredentials = Depends(security),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    get_current_user for async routes.
+    """
+    return await _load_user_async(db, await decode_token_async(token))
+
+
+async def get_current_user_cached(
+    token: HTTPAuthorizationCredentials = Depends(security),
+    db: AsyncSession = Depends(get_async_db)
+) -> schemas.UserIdentity:
+    """
+    The user's identity (id, clerk_id, email) from the per-process cache, so
+    read endpoints cost no database round-trip for auth. It carries no gem
+    balance; balance-sensitive endpoints use get_current_user.
+    """
+    payload = await decode_token_async(token)
+    identity = user_cache.get(payload["sub"])
+    if identity is not None:
+        return identity
+    # The session only connects on a miss
+    return schemas.UserIdentity.model_validate(await _load_user_async(db, payload))
+
+
+async def get_admin_user(
+    current_user: schemas.UserIdentity = Depends(get_current_user_cached)
+) -> schemas.UserIdentity:
+    """
+    get_current_user_cached, restricted to the users listed in ADMIN_CLERK_IDS.
+    """
+    if current_user.clerk_id not in ADMIN_CLERK_IDS:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required",
+        )
+    return current_user
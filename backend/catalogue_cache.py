@@ -0,0 +1,130 @@
+"""
+Cache of the serialized template catalogue (GET /api/v1/templates/).
+
+The catalogue is read on every landing page view and only changes when a
+template is created, so the JSON body is kept:
+  - in Redis, shared by all API processes, until the next template write
+  - in each process for CATALOGUE_LOCAL_TTL seconds, which bounds how long
+    another process can serve a catalogue that was just invalidated
+
+Each body has an ETag, so clients revalidate with If-None-Match and get a
+304 without a body. crud.create_template (used by the API, seed_templates.py
+and upload_template.py) calls invalidate().
+"""
+import os
+import time
+import hashlib
+import threading
+
+import result_cache
+
+CATALOGUE_LOCAL_TTL = float(os.getenv("CATALOGUE_LOCAL_TTL", "10"))
+# Browsers / CDNs may use a response this long without asking, and keep
+# serving it while revalidating for a day after that
+CATALOGUE_MAX_AGE = int(os.getenv("CATALOGUE_MAX_AGE", "300"))
+
+# Redis hash of "<skip>:<limit>" -> body, deleted as a whole on writes
+KEY = "catalogue:v1"
+# Incremented on writes, so a page loaded before a write is never stored after it
+GENERATION_KEY = "catalogue:v1:generation"
+
+_local = {}
+_lock = threading.Lock()
+
+
+def cache_control():
+    return f"public, max-age={CATALOGUE_MAX_AGE}, stale-while-revalidate=86400"
+
+
+def etag(body: bytes) -> str:
+    return f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+def etag_matches(if_none_match: str, tag: str) -> bool:
+    """
+    Whether an If-None-Match header names `tag` (weak comparison, or "*").
+    """
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == "*" or candidate == tag:
+            return True
+    return False
+
+
+def get_local(skip: int, limit: int):
+    """
+    (body, etag) from this process, or None.
+    """
+    entry = _local.get((skip, limit))
+    if entry is None or time.monotonic() > entry[2]:
+        return None
+    return entry[0], entry[1]
+
+
+def _store_local(skip, limit, body):
+    tag = etag(body)
+    with _lock:
+        _local[(skip, limit)] = (body, tag, time.monotonic() + CATALOGUE_LOCAL_TTL)
+    return body, tag
+
+
+def get(skip: int, limit: int):
+    """
+    ((body, etag) or None, generation) from this process or Redis. On a miss,
+    load the page and pass the generation on to store().
+    """
+    entry = get_local(skip, limit)
+    if entry is not None:
+        return entry, None
+    try:
+        pipe = result_cache.get_redis().pipeline(transaction=False)
+        pipe.hget(KEY, f"{skip}:{limit}")
+        pipe.get(GENERATION_KEY)
+        body, generation = pipe.execute()
+    except Exception as e:
+        print(f"Catalogue cache unavailable: {e}")
+        return None, None
+    if body is None:
+        return None, generation or "0"
+    return _store_local(skip, limit, body.encode()), None
+
+
+def store(skip: int, limit: int, body: bytes, generation: str = None):
+    """
+    Caches a freshly serialized page, unless a template was written since
+    `generation` was read (None: Redis is unavailable, cache in this process
+    only). Returns (body, etag).
+    """
+    if generation is None:
+        return _store_local(skip, limit, body)
+    try:
+        with result_cache.get_redis().pipeline() as pipe:
+            pipe.watch(GENERATION_KEY)
+            if (pipe.get(GENERATION_KEY) or "0") != generation:
+                return body, etag(body)
+            pipe.multi()
+            pipe.hset(KEY, f"{skip}:{limit}", body.decode())
+            pipe.execute()
+    except Exception as e:
+        # WatchError: a template was written meanwhile
+        if type(e).__name__ != "WatchError":
+            print(f"Catalogue cache unavailable: {e}")
+        return body, etag(body)
+    return _store_local(skip, limit, body)
+
+
+def invalidate():
+    """
+    Drops every cached catalogue page (call after any template write).
+    """
+    with _lock:
+        _local.clear()
+    try:
+        pipe = result_cache.get_redis().pipeline()
+        pipe.incr(GENERATION_KEY)
+        pipe.delete(KEY)
+        pipe.execute()
+    except Exception as e:
+        print(f"Catalogue cache not invalidated: {e}")
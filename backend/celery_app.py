@@ -20,3 +20,14 @@ celery_app.conf.update(
     timezone="UTC",
     enable_utc=True,
 )
+
+
+def queue_template_analysis(template_id: int):
+    """
+    Queues analyze_template_task, which precomputes a new template's face
+    index. Call it wherever a template is created (API and scripts).
+    """
+    try:
+        celery_app.send_task("analyze_template_task", args=[template_id])
+    except Exception as e:
+        print(f"Could not queue analysis of template {template_id}: {e}")
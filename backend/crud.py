@@ -1,5 +1,9 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import tuple_, update
+from sqlalchemy.orm import Session, load_only
+from datetime import datetime
+import base64
 import models, schemas
+import catalogue_cache
 from models import TaskStatus, TaskType
 
 def get_user_by_clerk_id(db: Session, clerk_id: str):
@@ -17,12 +21,18 @@ def create_user(db: Session, user: schemas.UserCreate):
     return db_user
 
 def update_user_gems(db: Session, user_id: int, amount: int):
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
-    if db_user:
-        db_user.gem_balance += amount
-        db.commit()
-        db.refresh(db_user)
-    return db_user
+    """
+    Adds `amount` gems in a single UPDATE, so concurrent updates are never lost.
+    Returns the new balance (None if the user does not exist).
+    """
+    balance = db.execute(
+        update(models.User)
+        .where(models.User.id == user_id)
+        .values(gem_balance=models.User.gem_balance + amount)
+        .returning(models.User.gem_balance)
+    ).scalar_one_or_none()
+    db.commit()
+    return balance
 
 def create_swap_task(db: Session, user_id: int, task: schemas.SwapTaskCreate, cost: int):
     db_task = models.SwapTask(
@@ -38,6 +48,42 @@ def create_swap_task(db: Session, user_id: int, task: schemas.SwapTaskCreate, co
     db.refresh(db_task)
     return db_task
 
+def debit_and_create_swap_task(db: Session, user_id: int, task: schemas.SwapTaskCreate, cost: int,
+                               status: TaskStatus = TaskStatus.PENDING, result_url: str = None):
+    """
+    Debits `cost` gems and inserts the task in one transaction. The debit is a
+    conditional UPDATE (gem_balance >= cost), so concurrent submissions can
+    never overspend. Returns (task, new balance), or (None, None) if the
+    balance is too low. The returned task is detached and fully loaded.
+    """
+    balance = db.execute(
+        update(models.User)
+        .where(models.User.id == user_id, models.User.gem_balance >= cost)
+        .values(gem_balance=models.User.gem_balance - cost)
+        .returning(models.User.gem_balance)
+    ).scalar_one_or_none()
+    if balance is None:
+        db.rollback()
+        return None, None
+
+    db_task = models.SwapTask(
+        user_id=user_id,
+        type=task.type,
+        cost=cost,
+        source_url=task.source_url,
+        template_url=task.template_url,
+        status=status,
+        result_url=result_url,
+        created_at=datetime.utcnow(),
+    )
+    db.add(db_task)
+    # The INSERT returns the id; everything else is already set, so after the
+    # commit the task is served from memory instead of being re-selected
+    db.flush()
+    db.expunge(db_task)
+    db.commit()
+    return db_task, balance
+
 def update_task_status(db: Session, task_id: int, status: TaskStatus, result_url: str = None, error_message: str = None):
     db_task = db.query(models.SwapTask).filter(models.SwapTask.id == task_id).first()
     if db_task:
@@ -50,8 +96,42 @@ def update_task_status(db: Session, task_id: int, status: TaskStatus, result_url
         db.refresh(db_task)
     return db_task
 
-def get_user_tasks(db: Session, user_id: int):
-    return db.query(models.SwapTask).filter(models.SwapTask.user_id == user_id).all()
+def encode_task_cursor(task: models.SwapTask) -> str:
+    return base64.urlsafe_b64encode(f"{task.created_at.isoformat()}|{task.id}".encode()).decode()
+
+def decode_task_cursor(cursor: str):
+    """
+    (created_at, id) of the last task of the previous page. Raises ValueError on a malformed cursor.
+    """
+    try:
+        created_at, task_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(task_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def get_user_tasks_page(db: Session, user_id: int, limit: int, cursor: str = None, status: TaskStatus = None):
+    """
+    One page of a user's tasks, newest first, and the cursor of the next page (None on the last).
+    Seeks on (user_id, created_at, id) through ix_swap_tasks_user_created_id,
+    so every page costs the same however long the history is.
+    """
+    query = db.query(models.SwapTask).options(load_only(
+        models.SwapTask.id,
+        models.SwapTask.type,
+        models.SwapTask.status,
+        models.SwapTask.template_url,
+        models.SwapTask.result_url,
+        models.SwapTask.created_at,
+    )).filter(models.SwapTask.user_id == user_id)
+    if status is not None:
+        query = query.filter(models.SwapTask.status == status)
+    if cursor:
+        created_at, task_id = decode_task_cursor(cursor)
+        query = query.filter(tuple_(models.SwapTask.created_at, models.SwapTask.id) < (created_at, task_id))
+
+    tasks = query.order_by(models.SwapTask.created_at.desc(), models.SwapTask.id.desc()).limit(limit + 1).all()
+    next_cursor = encode_task_cursor(tasks[limit - 1]) if len(tasks) > limit else None
+    return tasks[:limit], next_cursor
 
 def get_swap_task(db: Session, task_id: int):
     return db.query(models.SwapTask).filter(models.SwapTask.id == task_id).first()
@@ -75,4 +155,36 @@ def create_template(db: Session, template: schemas.TemplateCreate):
     db.add(db_template)
     db.commit()
     db.refresh(db_template)
+    catalogue_cache.invalidate()
     return db_template
+
+def create_upload(db: Session, user_id: int, bucket: str, path: str, url: str, content_type: str,
+                  status: models.UploadStatus = models.UploadStatus.PENDING, content_hash: str = None):
+    db_upload = models.Upload(
+        user_id=user_id,
+        bucket=bucket,
+        path=path,
+        url=url,
+        content_type=content_type,
+        status=status,
+        content_hash=content_hash
+    )
+    db.add(db_upload)
+    db.commit()
+    db.refresh(db_upload)
+    return db_upload
+
+def get_upload(db: Session, upload_id: int):
+    return db.query(models.Upload).filter(models.Upload.id == upload_id).first()
+
+def get_user_upload_by_url(db: Session, user_id: int, url: str):
+    return db.query(models.Upload).filter(models.Upload.user_id == user_id, models.Upload.url == url).first()
+
+def update_upload(db: Session, upload_id: int, **fields):
+    db_upload = db.query(models.Upload).filter(models.Upload.id == upload_id).first()
+    if db_upload:
+        for name, value in fields.items():
+            setattr(db_upload, name, value)
+        db.commit()
+        db.refresh(db_upload)
+    return db_upload
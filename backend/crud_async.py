@@ -0,0 +1,164 @@
+"""
+Async equivalents of crud.py for routes using database.get_async_db.
+
+Same functions, same semantics. Sessions come from an async_sessionmaker
+with expire_on_commit=False and all defaults are set client-side, so
+objects stay loaded after a commit and are not re-selected.
+"""
+from sqlalchemy import select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import load_only
+from datetime import datetime
+import models, schemas
+import catalogue_cache
+from models import TaskStatus
+from crud import encode_task_cursor, decode_task_cursor
+
+async def get_user_by_clerk_id(db: AsyncSession, clerk_id: str):
+    return await db.scalar(select(models.User).where(models.User.clerk_id == clerk_id))
+
+async def create_user(db: AsyncSession, user: schemas.UserCreate):
+    db_user = models.User(
+        clerk_id=user.clerk_id,
+        email=user.email,
+        gem_balance=5, # Default free gems
+        created_at=datetime.utcnow(),
+    )
+    db.add(db_user)
+    await db.commit()
+    return db_user
+
+async def update_user_gems(db: AsyncSession, user_id: int, amount: int):
+    """
+    Adds `amount` gems in a single UPDATE. Returns the new balance (None if the user does not exist).
+    """
+    balance = (await db.execute(
+        update(models.User)
+        .where(models.User.id == user_id)
+        .values(gem_balance=models.User.gem_balance + amount)
+        .returning(models.User.gem_balance)
+    )).scalar_one_or_none()
+    await db.commit()
+    return balance
+
+async def debit_and_create_swap_task(db: AsyncSession, user_id: int, task: schemas.SwapTaskCreate, cost: int,
+                                     status: TaskStatus = TaskStatus.PENDING, result_url: str = None):
+    """
+    See crud.debit_and_create_swap_task. Returns (task, new balance), or (None, None) if the balance is too low.
+    """
+    balance = (await db.execute(
+        update(models.User)
+        .where(models.User.id == user_id, models.User.gem_balance >= cost)
+        .values(gem_balance=models.User.gem_balance - cost)
+        .returning(models.User.gem_balance)
+    )).scalar_one_or_none()
+    if balance is None:
+        await db.rollback()
+        return None, None
+
+    db_task = models.SwapTask(
+        user_id=user_id,
+        type=task.type,
+        cost=cost,
+        source_url=task.source_url,
+        template_url=task.template_url,
+        status=status,
+        result_url=result_url,
+        created_at=datetime.utcnow(),
+    )
+    db.add(db_task)
+    await db.commit()
+    return db_task, balance
+
+async def update_task_status(db: AsyncSession, task_id: int, status: TaskStatus, result_url: str = None, error_message: str = None):
+    db_task = await get_swap_task(db, task_id)
+    if db_task:
+        db_task.status = status
+        if result_url:
+            db_task.result_url = result_url
+        if error_message:
+            db_task.error_message = error_message
+        await db.commit()
+    return db_task
+
+async def get_user_tasks_page(db: AsyncSession, user_id: int, limit: int, cursor: str = None, status: TaskStatus = None):
+    """
+    See crud.get_user_tasks_page.
+    """
+    query = select(models.SwapTask).options(load_only(
+        models.SwapTask.id,
+        models.SwapTask.type,
+        models.SwapTask.status,
+        models.SwapTask.template_url,
+        models.SwapTask.result_url,
+        models.SwapTask.created_at,
+    )).where(models.SwapTask.user_id == user_id)
+    if status is not None:
+        query = query.where(models.SwapTask.status == status)
+    if cursor:
+        created_at, task_id = decode_task_cursor(cursor)
+        query = query.where(tuple_(models.SwapTask.created_at, models.SwapTask.id) < (created_at, task_id))
+
+    query = query.order_by(models.SwapTask.created_at.desc(), models.SwapTask.id.desc()).limit(limit + 1)
+    tasks = (await db.scalars(query)).all()
+    next_cursor = encode_task_cursor(tasks[limit - 1]) if len(tasks) > limit else None
+    return tasks[:limit], next_cursor
+
+async def get_swap_task(db: AsyncSession, task_id: int):
+    return await db.get(models.SwapTask, task_id)
+
+async def get_templates(db: AsyncSession, skip: int = 0, limit: int = 100):
+    return (await db.scalars(select(models.Template).offset(skip).limit(limit))).all()
+
+async def get_template(db: AsyncSession, template_id: int):
+    return await db.get(models.Template, template_id)
+
+async def create_template(db: AsyncSession, template: schemas.TemplateCreate):
+    # Ensure type is Enum
+    task_type = models.TaskType[template.type.upper()]
+    db_template = models.Template(
+        title=template.title,
+        type=task_type,
+        thumbnail=template.thumbnail,
+        source_url=template.source_url or template.thumbnail, # Fallback to thumbnail if no source provided (e.g. images)
+        cost=template.cost,
+        created_at=datetime.utcnow(),
+    )
+    db.add(db_template)
+    await db.commit()
+    catalogue_cache.invalidate()
+    return db_template
+
+async def create_upload(db: AsyncSession, user_id: int, bucket: str, path: str, url: str, content_type: str,
+                        status: models.UploadStatus = models.UploadStatus.PENDING, content_hash: str = None):
+    db_upload = models.Upload(
+        user_id=user_id,
+        bucket=bucket,
+        path=path,
+        url=url,
+        content_type=content_type,
+        status=status,
+        content_hash=content_hash,
+        face_status=models.FaceStatus.PENDING,
+        created_at=datetime.utcnow(),
+    )
+    db.add(db_upload)
+    await db.commit()
+    return db_upload
+
+async def get_upload(db: AsyncSession, upload_id: int):
+    return await db.get(models.Upload, upload_id)
+
+async def get_upload_by_url(db: AsyncSession, url: str):
+    return await db.scalar(select(models.Upload).where(models.Upload.url == url))
+
+async def get_user_upload_by_url(db: AsyncSession, user_id: int, url: str):
+    return await db.scalar(select(models.Upload).where(models.Upload.user_id == user_id, models.Upload.url == url))
+
+async def update_upload(db: AsyncSession, upload_id: int, **fields):
+    db_upload = await get_upload(db, upload_id)
+    if db_upload:
+        for name, value in fields.items():
+            setattr(db_upload, name, value)
+        await db.commit()
+    return db_upload
@@ -1,6 +1,7 @@
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 import os
+import uuid
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -32,10 +33,19 @@ connect_args = {}
 if "supabase." in DATABASE_URL:
     connect_args = {"sslmode": "require"}
 
+# Explicit pool sizes: with the Supavisor pooler (port 6543) every pooled
+# connection is a client slot on the pooler, so keep size * processes in budget
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+
 engine = create_engine(
     DATABASE_URL, 
     pool_pre_ping=True, 
     pool_recycle=300,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
     connect_args=connect_args
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -46,3 +56,53 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# Async engine (asyncpg) for the async API routes. Created on first use, so
+# the worker and scripts never need asyncpg.
+_async_engine = None
+_AsyncSessionLocal = None
+
+def async_database_url():
+    """
+    DATABASE_URL for asyncpg, and its connect_args. asyncpg has no `sslmode`
+    parameter, so it becomes the `ssl` connect argument.
+    """
+    from sqlalchemy.engine import make_url
+
+    url = make_url(DATABASE_URL)
+    url = url.set(drivername="postgresql+asyncpg")
+    args = {
+        # Supavisor in transaction mode (port 6543) hands each transaction to
+        # a different server connection: prepared statements must not be cached
+        "statement_cache_size": 0,
+        "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__",
+    }
+    sslmode = url.query.get("sslmode")
+    if sslmode:
+        url = url.difference_update_query(["sslmode"])
+    if sslmode in ("require", "verify-ca", "verify-full") or "supabase." in DATABASE_URL:
+        args["ssl"] = "require"
+    return url, args
+
+def get_async_engine():
+    global _async_engine, _AsyncSessionLocal
+    if _async_engine is None:
+        from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+        url, args = async_database_url()
+        _async_engine = create_async_engine(
+            url,
+            pool_pre_ping=True,
+            pool_recycle=300,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            connect_args=args,
+        )
+        _AsyncSessionLocal = async_sessionmaker(_async_engine, autoflush=False, expire_on_commit=False)
+    return _async_engine
+
+async def get_async_db():
+    get_async_engine()
+    async with _AsyncSessionLocal() as db:
+        yield db
@@ -42,10 +42,21 @@ os.makedirs("static", exist_ok=True)
 os.makedirs("static/uploads", exist_ok=True)
 os.makedirs("static/results", exist_ok=True)
 
+import storage
+if storage.STORAGE_BACKEND == "local" and storage.STORAGE_LOCAL_URL.startswith("/"):
+    # Serve the local storage backend (mounted before /static, which may contain it)
+    os.makedirs(storage.STORAGE_LOCAL_ROOT, exist_ok=True)
+    app.mount(storage.STORAGE_LOCAL_URL, StaticFiles(directory=storage.STORAGE_LOCAL_ROOT), name="storage")
+
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 app.include_router(api_router, prefix="/api/v1")
 
+@app.on_event("startup")
+def prefetch_jwks():
+    import auth
+    auth.start()
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to Ultimate Faceswap API"}
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Enum, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, Enum, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -16,6 +16,15 @@ class TaskType(enum.Enum):
     IMAGE = "IMAGE"
     VIDEO = "VIDEO"
 
+class UploadStatus(enum.Enum):
+    PENDING = "PENDING"     # signed URL issued, nothing confirmed yet
+    UPLOADED = "UPLOADED"   # object confirmed in storage
+
+class FaceStatus(enum.Enum):
+    PENDING = "PENDING"     # not analyzed yet
+    FOUND = "FOUND"
+    NOT_FOUND = "NOT_FOUND"
+
 class User(Base):
     __tablename__ = "users"
 
@@ -27,6 +36,7 @@ class User(Base):
 
     tasks = relationship("SwapTask", back_populates="user")
     transactions = relationship("Transaction", back_populates="user")
+    uploads = relationship("Upload", back_populates="user")
 
 class SwapTask(Base):
     __tablename__ = "swap_tasks"
@@ -44,6 +54,11 @@ class SwapTask(Base):
 
     user = relationship("User", back_populates="tasks")
 
+    __table_args__ = (
+        # History pages: a user's tasks, newest first (keyset on created_at, id)
+        Index("ix_swap_tasks_user_created_id", "user_id", "created_at", "id"),
+    )
+
 class Transaction(Base):
     __tablename__ = "transactions"
 
@@ -67,3 +82,19 @@ class Template(Base):
     source_url = Column(String, nullable=True) # Actual video/image source
     cost = Column(Integer)
     created_at = Column(DateTime, default=datetime.utcnow)
+
+class Upload(Base):
+    __tablename__ = "uploads"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    bucket = Column(String)
+    path = Column(String)
+    url = Column(String, index=True)
+    content_type = Column(String)
+    status = Column(Enum(UploadStatus), default=UploadStatus.PENDING)
+    content_hash = Column(String, nullable=True, index=True)
+    face_status = Column(Enum(FaceStatus), default=FaceStatus.PENDING)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    user = relationship("User", back_populates="uploads")
@@ -0,0 +1,147 @@
+"""
+Live task progress over Redis pub/sub.
+
+The worker publishes every status change and, for videos, the fraction of
+frames done. The API relays these to clients as server-sent events
+(GET /api/v1/swaps/{task_id}/events), so waiting clients no longer poll
+Postgres. The latest event of each task is also kept in a key, which lets
+a client that connects late start from the current state.
+
+Publishing is best-effort: without Redis the worker just carries on and
+clients fall back to polling.
+"""
+import os
+import json
+import time
+
+import result_cache
+
+# Minimum seconds between two progress events of the same task (or segment)
+PROGRESS_MIN_INTERVAL = float(os.getenv("PROGRESS_MIN_INTERVAL", "0.5"))
+# How long the latest state of a task stays readable after its last event
+PROGRESS_TTL_SECONDS = 24 * 3600
+
+PREFIX = "task_progress"
+
+TERMINAL_STATUSES = ("COMPLETED", "FAILED")
+
+_async_redis = None
+
+
+def get_async_redis():
+    """
+    Shared asyncio client for the API's event streams (each subscription
+    holds one connection of its pool while open).
+    """
+    global _async_redis
+    if _async_redis is None:
+        import redis.asyncio
+        _async_redis = redis.asyncio.Redis.from_url(result_cache.REDIS_URL, socket_connect_timeout=2, decode_responses=True)
+    return _async_redis
+
+
+def channel(task_id: int) -> str:
+    return f"{PREFIX}:{task_id}"
+
+
+def _state_key(task_id: int) -> str:
+    return f"{PREFIX}:state:{task_id}"
+
+
+def _parts_key(task_id: int) -> str:
+    return f"{PREFIX}:parts:{task_id}"
+
+
+def publish(task_id: int, status: str, progress: float = None, result_url: str = None, error_message: str = None):
+    """
+    Sends an event {"task_id", "status", "progress", "result_url", "error_message"}
+    to the task's subscribers and saves it as the task's latest state.
+    """
+    event = {
+        "task_id": task_id,
+        "status": status,
+        "progress": progress,
+        "result_url": result_url,
+        "error_message": error_message,
+    }
+    data = json.dumps(event)
+    try:
+        pipe = result_cache.get_redis().pipeline()
+        pipe.set(_state_key(task_id), data, ex=PROGRESS_TTL_SECONDS)
+        pipe.publish(channel(task_id), data)
+        pipe.execute()
+    except Exception as e:
+        print(f"Progress not published for task {task_id}: {e}")
+
+
+class ProgressReporter:
+    """
+    Publishes frame progress of a task, at most every PROGRESS_MIN_INTERVAL seconds:
+
+        reporter = ProgressReporter(task_id)
+        reporter.update(frame_count, total_frames)
+
+    A video split into segments reports one part per segment; the published
+    progress is the mean over all `parts`.
+    """
+
+    def __init__(self, task_id: int, part: int = None, parts: int = 1):
+        self.task_id = task_id
+        self.part = part
+        self.parts = parts
+        self._last = 0.0
+
+    def update(self, done: int, total: int):
+        now = time.monotonic()
+        if not total or now - self._last < PROGRESS_MIN_INTERVAL:
+            return
+        self._last = now
+        fraction = min(done / total, 1.0)
+
+        if self.part is not None:
+            try:
+                r = result_cache.get_redis()
+                pipe = r.pipeline()
+                pipe.hset(_parts_key(self.task_id), str(self.part), fraction)
+                pipe.expire(_parts_key(self.task_id), PROGRESS_TTL_SECONDS)
+                pipe.hvals(_parts_key(self.task_id))
+                fractions = pipe.execute()[-1]
+            except Exception as e:
+                print(f"Progress not published for task {self.task_id}: {e}")
+                return
+            fraction = sum(float(f) for f in fractions) / self.parts
+
+        publish(self.task_id, "PROCESSING", progress=round(fraction, 4))
+
+
+async def subscribe(task_id: int):
+    """
+    Async iterator over the events of a task, starting with its latest state.
+    Yields None when nothing was published for a while (time for a keep-alive)
+    and ends after a COMPLETED or FAILED event.
+    """
+    client = get_async_redis()
+    pubsub = client.pubsub()
+    try:
+        # Subscribe before reading the latest state so no event falls in between
+        await pubsub.subscribe(channel(task_id))
+        data = await client.get(_state_key(task_id))
+        if data:
+            event = json.loads(data)
+            yield event
+            if event["status"] in TERMINAL_STATUSES:
+                return
+
+        while True:
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=15)
+            if message is None:
+                yield None
+                continue
+            event = json.loads(message["data"])
+            yield event
+            if event["status"] in TERMINAL_STATUSES:
+                return
+    finally:
+        await pubsub.unsubscribe()
+        # aclose() is redis-py >= 5.0.1, close() before that
+        await (pubsub.aclose() if hasattr(pubsub, "aclose") else pubsub.close())
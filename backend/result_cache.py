@@ -0,0 +1,138 @@
+"""
+Content-addressed cache of finished swap results, in Redis.
+
+A result is keyed by (source content hash, template content hash,
+PIPELINE_VERSION), so resubmitting the same selfie against the same
+template completes instantly with the earlier result_url. Media URLs are
+mapped to content hashes as they become known (source uploads in the API,
+templates in the worker), which lets the API answer repeats without
+dispatching anything.
+
+Shared by the API and the worker. Every operation is best-effort: without
+Redis the cache is simply empty.
+"""
+import os
+import hashlib
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# Bump whenever the swap output changes (models, blending, encoder settings)
+# so earlier results are no longer served for new submissions.
+PIPELINE_VERSION = os.getenv("PIPELINE_VERSION", "1")
+
+# Results stay in storage at least this long; cache entries must not outlive them
+RESULT_RETENTION_DAYS = int(os.getenv("RESULT_RETENTION_DAYS", "30"))
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE", "1") == "1"
+
+PREFIX = "result_cache"
+
+_redis = None
+
+
+def get_redis():
+    global _redis
+    if _redis is None:
+        import redis
+        _redis = redis.Redis.from_url(REDIS_URL, socket_timeout=2, socket_connect_timeout=2, decode_responses=True)
+    return _redis
+
+
+def _ttl():
+    return RESULT_RETENTION_DAYS * 24 * 3600
+
+
+def _url_key(url: str) -> str:
+    return f"{PREFIX}:hash:{hashlib.sha256(url.encode()).hexdigest()}"
+
+
+def _result_key(source_hash: str, template_hash: str) -> str:
+    return f"{PREFIX}:v{PIPELINE_VERSION}:{source_hash}:{template_hash}"
+
+
+def record_content_hash(url: str, content_hash: str):
+    """
+    Remembers the content hash of the media at `url`.
+    """
+    if not RESULT_CACHE_ENABLED or not url or not content_hash:
+        return
+    try:
+        get_redis().set(_url_key(url), content_hash, ex=_ttl())
+    except Exception as e:
+        print(f"Result cache unavailable: {e}")
+
+
+def content_hash(url: str):
+    """
+    Content hash recorded for a media URL, or None.
+    """
+    if not RESULT_CACHE_ENABLED or not url:
+        return None
+    try:
+        return get_redis().get(_url_key(url))
+    except Exception as e:
+        print(f"Result cache unavailable: {e}")
+        return None
+
+
+def lookup(source_hash: str, template_hash: str, count_miss: bool = True):
+    """
+    result_url of an earlier swap of the same source and template, or None.
+    Counts a hit (and a miss, unless the caller hands the task on to
+    someone who will look again).
+    """
+    if not RESULT_CACHE_ENABLED or not source_hash or not template_hash:
+        return None
+    try:
+        r = get_redis()
+        result_url = r.get(_result_key(source_hash, template_hash))
+        if result_url:
+            r.incr(f"{PREFIX}:hits")
+        elif count_miss:
+            r.incr(f"{PREFIX}:misses")
+        return result_url
+    except Exception as e:
+        print(f"Result cache unavailable: {e}")
+        return None
+
+
+def lookup_urls(source_url: str, template_url: str):
+    """
+    Same as lookup, for media URLs whose content hashes are already known
+    (the API's fast path). Misses are not counted: the worker looks again.
+    """
+    source_hash = content_hash(source_url)
+    template_hash = content_hash(template_url) if source_hash else None
+    if not source_hash or not template_hash:
+        return None
+    return lookup(source_hash, template_hash, count_miss=False)
+
+
+def store(source_hash: str, template_hash: str, result_url: str):
+    if not RESULT_CACHE_ENABLED or not source_hash or not template_hash or not result_url:
+        return
+    try:
+        get_redis().set(_result_key(source_hash, template_hash), result_url, ex=_ttl())
+    except Exception as e:
+        print(f"Result cache unavailable: {e}")
+
+
+def stats():
+    """
+    Hit / miss counters since the counters were created (they are never reset).
+    """
+    try:
+        hits, misses = get_redis().mget(f"{PREFIX}:hits", f"{PREFIX}:misses")
+    except Exception as e:
+        print(f"Result cache unavailable: {e}")
+        return {"enabled": RESULT_CACHE_ENABLED, "available": False, "pipeline_version": PIPELINE_VERSION,
+                "hits": 0, "misses": 0, "hit_rate": 0.0}
+    hits, misses = int(hits or 0), int(misses or 0)
+    total = hits + misses
+    return {
+        "enabled": RESULT_CACHE_ENABLED,
+        "available": True,
+        "pipeline_version": PIPELINE_VERSION,
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / total if total else 0.0,
+    }
@@ -1,7 +1,7 @@
 from pydantic import BaseModel, EmailStr
 from datetime import datetime
 from typing import Optional, List
-from models import TaskStatus, TaskType
+from models import TaskStatus, TaskType, UploadStatus, FaceStatus
 
 class UserBase(BaseModel):
     email: EmailStr
@@ -18,6 +18,14 @@ class User(UserBase):
     class Config:
         from_attributes = True
 
+class UserIdentity(BaseModel):
+    id: int
+    clerk_id: str
+    email: str
+
+    class Config:
+        from_attributes = True
+
 class SwapTaskBase(BaseModel):
     type: TaskType
     source_url: str
@@ -37,6 +45,43 @@ class SwapTask(SwapTaskBase):
     class Config:
         from_attributes = True
 
+class SwapTaskSummary(BaseModel):
+    id: int
+    type: TaskType
+    status: TaskStatus
+    template_url: Optional[str] = None
+    result_url: Optional[str] = None
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class SwapTaskPage(BaseModel):
+    items: List[SwapTaskSummary]
+    next_cursor: Optional[str] = None
+
+class UploadUrlRequest(BaseModel):
+    content_type: str
+
+class UploadUrl(BaseModel):
+    upload_id: int
+    upload_url: str
+    method: str
+    headers: dict
+    url: str
+    expires_in: int
+
+class Upload(BaseModel):
+    id: int
+    url: str
+    content_type: str
+    status: UploadStatus
+    face_status: FaceStatus
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
 class TemplateBase(BaseModel):
     title: str
     type: str
@@ -0,0 +1,42 @@
+"""
+Source faces analyzed ahead of time, in Redis.
+
+When a user uploads a selfie the worker detects the face and computes its
+identity embedding right away (preprocess_upload_task), keyed by the image
+content hash. Swap tasks then start with the source face already available.
+"""
+import os
+import json
+
+import result_cache
+
+SOURCE_FACE_TTL_DAYS = int(os.getenv("SOURCE_FACE_TTL_DAYS", "7"))
+
+# Bump when the detector or recognizer changes
+PREFIX = "source_face:v1"
+
+
+def store(content_hash: str, face: dict):
+    """
+    Saves a face as {"embedding", "kps", "bbox", "det_score"} (plain lists / floats).
+    """
+    if not content_hash:
+        return
+    try:
+        result_cache.get_redis().set(f"{PREFIX}:{content_hash}", json.dumps(face), ex=SOURCE_FACE_TTL_DAYS * 24 * 3600)
+    except Exception as e:
+        print(f"Source face cache unavailable: {e}")
+
+
+def load(content_hash: str):
+    """
+    The stored face dict for an image content hash, or None.
+    """
+    if not content_hash:
+        return None
+    try:
+        data = result_cache.get_redis().get(f"{PREFIX}:{content_hash}")
+    except Exception as e:
+        print(f"Source face cache unavailable: {e}")
+        return None
+    return json.loads(data) if data else None
@@ -1,58 +1,484 @@
 import os
+import time
+import threading
 from supabase import create_client, Client
-import shutil
 
 # Initialize Supabase
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY") # Use service role for backend operations
 
+# "supabase" (default) or "local". The local backend keeps objects under
+# STORAGE_LOCAL_ROOT/<bucket>/<path> and serves them from the API at
+# STORAGE_LOCAL_URL; an API and worker sharing that directory never go over HTTP.
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "supabase")
+STORAGE_LOCAL_ROOT = os.path.abspath(os.getenv(
+    "STORAGE_LOCAL_ROOT",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "storage"),
+))
+STORAGE_LOCAL_URL = os.getenv("STORAGE_LOCAL_URL", "/storage").rstrip("/")
+# Signed direct uploads to the local backend go to this API route, authorized by an
+# HMAC with STORAGE_SIGNING_SECRET (must be the same on every API process)
+STORAGE_LOCAL_UPLOAD_URL = os.getenv("STORAGE_LOCAL_UPLOAD_URL", "/api/v1/swaps/signed-upload").rstrip("/")
+STORAGE_SIGNING_SECRET = os.getenv("STORAGE_SIGNING_SECRET", "")
+
+# Transfers: (connect, read) timeouts in seconds, retries per transfer and the
+# base of the exponential backoff between attempts
+STORAGE_CONNECT_TIMEOUT = float(os.getenv("STORAGE_CONNECT_TIMEOUT", "10"))
+STORAGE_READ_TIMEOUT = float(os.getenv("STORAGE_READ_TIMEOUT", "60"))
+STORAGE_RETRIES = int(os.getenv("STORAGE_RETRIES", "3"))
+STORAGE_BACKOFF = float(os.getenv("STORAGE_BACKOFF", "0.5"))
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Keep-alive connections kept per host
+STORAGE_POOL_SIZE = int(os.getenv("STORAGE_POOL_SIZE", "16"))
+
+_lock = threading.Lock()
+_supabase = None
+_session = None
+_download = None
+_backend = None
+
 def get_supabase() -> Client:
+    """
+    Process-wide Supabase client, so uploads reuse its connections.
+    """
+    global _supabase
     if not SUPABASE_URL or not SUPABASE_KEY:
         print("Warning: Supabase credentials not found.")
         return None
-    return create_client(SUPABASE_URL, SUPABASE_KEY)
+    with _lock:
+        if _supabase is None:
+            _supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+    return _supabase
+
+def _new_session(retries):
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    retry = Retry(
+        total=retries,
+        backoff_factor=STORAGE_BACKOFF,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=("GET", "HEAD"),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=STORAGE_POOL_SIZE, pool_maxsize=STORAGE_POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def http_session():
+    """
+    Process-wide requests.Session: keep-alive connection pool, and retries with
+    backoff on connection errors and 429/5xx responses for GET/HEAD.
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            _session = _new_session(STORAGE_RETRIES)
+    return _session
+
+def _download_session():
+    """
+    Like http_session, but without adapter retries: http_download retries
+    whole downloads itself, since a body can also break off midway.
+    """
+    global _download
+    with _lock:
+        if _download is None:
+            _download = _new_session(0)
+    return _download
+
+def timeout():
+    return (STORAGE_CONNECT_TIMEOUT, STORAGE_READ_TIMEOUT)
+
+_async_client = None
+
+def async_http_client():
+    """
+    Shared httpx.AsyncClient for streaming uploads from async routes.
+    """
+    global _async_client
+    if _async_client is None:
+        import httpx
+        _async_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(STORAGE_READ_TIMEOUT, connect=STORAGE_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_keepalive_connections=STORAGE_POOL_SIZE),
+        )
+    return _async_client
+
+def _backoff(attempt):
+    time.sleep(STORAGE_BACKOFF * (2 ** attempt))
 
 import mimetypes
 
-def upload_file(file_path: str, bucket_name: str, destination_path: str) -> str:
+def http_download(url: str, save_path: str):
     """
-    Uploads a file to Supabase Storage and returns the public URL.
+    Downloads a URL to a local path with the pooled connections. Connection
+    errors, 429/5xx responses and downloads that break off midway are
+    restarted with backoff.
     """
-    supabase = get_supabase()
-    if not supabase:
+    import requests
+    for attempt in range(STORAGE_RETRIES + 1):
+        try:
+            with _download_session().get(url, stream=True, timeout=timeout()) as response:
+                if response.status_code == 200:
+                    with open(save_path, 'wb') as f:
+                        for chunk in response.iter_content(1024 * 1024):
+                            f.write(chunk)
+                    return True
+                print(f"Download of {url} failed: HTTP {response.status_code}")
+                if response.status_code not in RETRY_STATUSES:
+                    return False
+        except requests.RequestException as e:
+            print(f"Download of {url} failed: {e}")
+        if attempt == STORAGE_RETRIES:
+            return False
+        _backoff(attempt)
+
+def http_head(url: str, size: int):
+    """
+    (first `size` bytes, total size) of a URL via a range request, or None if it is missing.
+    """
+    response = http_session().get(url, headers={"Range": f"bytes=0-{size - 1}"}, timeout=timeout())
+    if response.status_code not in (200, 206):
         return None
+    total = response.headers.get("Content-Range", "").rpartition("/")[2]
+    return response.content[:size], int(total) if total.isdigit() else len(response.content)
+
+def sign_upload(bucket_name: str, path: str, expires: int) -> str:
+    import hmac
+    import hashlib
+    if not STORAGE_SIGNING_SECRET:
+        raise RuntimeError("STORAGE_SIGNING_SECRET is not set")
+    message = f"{bucket_name}/{path}:{expires}".encode()
+    return hmac.new(STORAGE_SIGNING_SECRET.encode(), message, hashlib.sha256).hexdigest()
+
+def verify_upload_signature(bucket_name: str, path: str, expires: int, signature: str) -> bool:
+    import hmac
+    if expires < time.time():
+        return False
+    return hmac.compare_digest(sign_upload(bucket_name, path, expires), signature or "")
 
+def sendfile_copy(src: str, dst: str):
+    """
+    Copies a file in the kernel (os.sendfile), without passing the data through Python.
+    """
+    with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+        size = os.fstat(fin.fileno()).st_size
+        offset = 0
+        while offset < size:
+            sent = os.sendfile(fout.fileno(), fin.fileno(), offset, size - offset)
+            if sent == 0:
+                break
+            offset += sent
+
+def link_or_copy(src: str, dst: str):
+    """
+    Hardlinks src to dst (replacing dst), or copies it with sendfile across filesystems.
+    """
+    tmp = f"{dst}.{os.getpid()}.{threading.get_ident()}.tmp"
     try:
+        try:
+            os.link(src, tmp)
+        except OSError:
+            sendfile_copy(src, tmp)
+        os.replace(tmp, dst)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+class StorageBackend:
+    """
+    Where uploads, templates, results and worker artifacts are kept.
+    Objects are addressed by (bucket, path) and referred to by URL elsewhere.
+    """
+
+    def url(self, bucket_name: str, path: str) -> str:
+        raise NotImplementedError
+
+    def put(self, file_path: str, bucket_name: str, path: str) -> str:
+        """
+        Stores a local file and returns its URL, or None on failure.
+        """
+        raise NotImplementedError
+
+    async def put_stream(self, chunks, bucket_name: str, path: str, content_type: str) -> str:
+        """
+        Stores the bytes of an async iterable as they arrive and returns the URL,
+        or None on failure. Exceptions raised by `chunks` abort the upload and propagate.
+        """
+        raise NotImplementedError
+
+    def get(self, url: str, save_path: str) -> bool:
+        """
+        Copies the object at `url` to a local path.
+        """
+        return http_download(url, save_path)
+
+    def signed_upload(self, bucket_name: str, path: str, content_type: str, expires_in: int) -> dict:
+        """
+        Lets a client upload one object directly, without passing through the API.
+        Returns {"upload_url", "method", "headers"}.
+        """
+        raise NotImplementedError
+
+    def head(self, url: str, size: int):
+        """
+        (first `size` bytes, total size) of a stored object, or None if it does not exist.
+        """
+        return http_head(url, size)
+
+    def delete(self, bucket_name: str, paths: list) -> bool:
+        raise NotImplementedError
+
+    def local_path(self, url: str):
+        """
+        Path of the object on this machine's filesystem, if it is stored there.
+        """
+        return None
+
+class SupabaseStorage(StorageBackend):
+    def url(self, bucket_name, path):
+        """
+        Public URL of an object in a public bucket.
+        Format: <SUPABASE_URL>/storage/v1/object/public/<bucket>/<path>
+        """
+        if not SUPABASE_URL:
+            return None
+        return f"{SUPABASE_URL}/storage/v1/object/public/{bucket_name}/{path}"
+
+    def put(self, file_path, bucket_name, path):
+        """
+        Uploads a file to Supabase Storage and returns the public URL.
+        Transient failures are retried with exponential backoff (the Supabase
+        client does not retry on its own, so this is the only retry layer).
+        """
+        supabase = get_supabase()
+        if not supabase:
+            return None
+
         # Guess MIME type
-        content_type, _ = mimetypes.guess_type(destination_path)
+        content_type, _ = mimetypes.guess_type(path)
         if not content_type:
             content_type = "application/octet-stream"
 
-        with open(file_path, 'rb') as f:
-            supabase.storage.from_(bucket_name).upload(
-                file=f,
-                path=destination_path,
-                file_options={"content-type": content_type}
+        for attempt in range(STORAGE_RETRIES + 1):
+            try:
+                with open(file_path, 'rb') as f:
+                    supabase.storage.from_(bucket_name).upload(
+                        file=f,
+                        path=path,
+                        file_options={"content-type": content_type}
+                    )
+
+                # Get Public URL
+                # For public buckets, we can construct it manually or ask SDK
+                return self.url(bucket_name, path)
+            except Exception as e:
+                print(f"Supabase Upload Error: {e}")
+                if "Duplicate" in str(e) or "already exists" in str(e):
+                    # On a retry, that is our own earlier attempt which timed
+                    # out after the object was stored
+                    return self.url(bucket_name, path) if attempt > 0 else None
+                if attempt == STORAGE_RETRIES:
+                    return None
+                _backoff(attempt)
+
+    async def put_stream(self, chunks, bucket_name, path, content_type):
+        """
+        Streams the body straight to the Storage REST API (chunked transfer encoding).
+        """
+        import httpx
+        if not SUPABASE_URL or not SUPABASE_KEY:
+            print("Warning: Supabase credentials not found.")
+            return None
+        try:
+            response = await async_http_client().post(
+                f"{SUPABASE_URL}/storage/v1/object/{bucket_name}/{path}",
+                content=chunks,
+                headers={
+                    "Authorization": f"Bearer {SUPABASE_KEY}",
+                    "apikey": SUPABASE_KEY,
+                    "Content-Type": content_type,
+                    "x-upsert": "false",
+                },
             )
-        
-        # Get Public URL
-        # For public buckets, we can construct it manually or ask SDK
-        # Public URL format: <SUPABASE_URL>/storage/v1/object/public/<bucket>/<path>
-        public_url = f"{SUPABASE_URL}/storage/v1/object/public/{bucket_name}/{destination_path}"
-        return public_url
-    except Exception as e:
-        print(f"Supabase Upload Error: {e}")
-        # Identify if it's already there?
-        return None
+            if response.status_code >= 400:
+                print(f"Supabase Upload Error: HTTP {response.status_code} {response.text}")
+                return None
+            return self.url(bucket_name, path)
+        except httpx.HTTPError as e:
+            print(f"Supabase Upload Error: {e}")
+            return None
+
+    def signed_upload(self, bucket_name, path, content_type, expires_in):
+        """
+        Supabase signed upload URL (Supabase fixes its lifetime at 2 hours; the
+        shorter expires_in is enforced when the upload is confirmed).
+        """
+        supabase = get_supabase()
+        if not supabase:
+            return None
+        signed = supabase.storage.from_(bucket_name).create_signed_upload_url(path)
+        return {
+            "upload_url": signed.get("signed_url") or signed.get("signedUrl"),
+            "method": "PUT",
+            "headers": {"Content-Type": content_type, "x-upsert": "false"},
+        }
+
+    def delete(self, bucket_name, paths):
+        supabase = get_supabase()
+        if not supabase:
+            return False
+        try:
+            supabase.storage.from_(bucket_name).remove(list(paths))
+            return True
+        except Exception as e:
+            print(f"Supabase Delete Error: {e}")
+            return False
+
+class LocalStorage(StorageBackend):
+    def __init__(self, root=STORAGE_LOCAL_ROOT, base_url=STORAGE_LOCAL_URL):
+        self.root = root
+        self.base_url = base_url
+
+    def _path(self, bucket_name, path):
+        full = os.path.realpath(os.path.join(self.root, bucket_name, path))
+        if not full.startswith(os.path.realpath(self.root) + os.sep):
+            raise ValueError(f"Invalid storage path: {bucket_name}/{path}")
+        return full
+
+    def url(self, bucket_name, path):
+        return f"{self.base_url}/{bucket_name}/{path}"
+
+    def local_path(self, url):
+        if not url or not url.startswith(self.base_url + "/"):
+            return None
+        try:
+            bucket_name, _, path = url[len(self.base_url) + 1:].split("?")[0].partition("/")
+            return self._path(bucket_name, path)
+        except ValueError:
+            return None
+
+    def put(self, file_path, bucket_name, path):
+        try:
+            dest = self._path(bucket_name, path)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            link_or_copy(file_path, dest)
+            return self.url(bucket_name, path)
+        except (OSError, ValueError) as e:
+            print(f"Local Storage Error: {e}")
+            return None
+
+    async def put_stream(self, chunks, bucket_name, path, content_type):
+        """
+        Writes the body to a temp file and renames it into place. File calls
+        run in the threadpool so a slow disk does not stall the event loop.
+        """
+        from fastapi.concurrency import run_in_threadpool
+        try:
+            dest = self._path(bucket_name, path)
+            await run_in_threadpool(os.makedirs, os.path.dirname(dest), exist_ok=True)
+        except (OSError, ValueError) as e:
+            print(f"Local Storage Error: {e}")
+            return None
+        tmp = f"{dest}.{os.getpid()}.{id(chunks)}.tmp"
+        try:
+            f = await run_in_threadpool(open, tmp, 'wb')
+            try:
+                async for chunk in chunks:
+                    await run_in_threadpool(f.write, chunk)
+            finally:
+                await run_in_threadpool(f.close)
+            await run_in_threadpool(os.replace, tmp, dest)
+            return self.url(bucket_name, path)
+        finally:
+            if os.path.exists(tmp):
+                await run_in_threadpool(os.remove, tmp)
+
+    def signed_upload(self, bucket_name, path, content_type, expires_in):
+        expires = int(time.time()) + expires_in
+        signature = sign_upload(bucket_name, path, expires)
+        return {
+            "upload_url": f"{STORAGE_LOCAL_UPLOAD_URL}/{bucket_name}/{path}?expires={expires}&signature={signature}",
+            "method": "PUT",
+            "headers": {"Content-Type": content_type},
+        }
+
+    def head(self, url, size):
+        path = self.local_path(url)
+        if path is None:
+            return super().head(url, size)
+        try:
+            with open(path, 'rb') as f:
+                return f.read(size), os.fstat(f.fileno()).st_size
+        except OSError:
+            return None
+
+    def get(self, url, save_path):
+        path = self.local_path(url)
+        if path is None:
+            return super().get(url, save_path)
+        if not os.path.exists(path):
+            print(f"Download of {url} failed: not found")
+            return False
+        link_or_copy(path, save_path)
+        return True
+
+    def delete(self, bucket_name, paths):
+        for path in paths:
+            try:
+                os.remove(self._path(bucket_name, path))
+            except (OSError, ValueError):
+                pass
+        return True
+
+def get_backend() -> StorageBackend:
+    global _backend
+    if _backend is None:
+        if STORAGE_BACKEND == "local":
+            _backend = LocalStorage()
+        elif STORAGE_BACKEND == "supabase":
+            _backend = SupabaseStorage()
+        else:
+            raise ValueError(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND!r} (expected supabase or local)")
+    return _backend
+
+# Module-level helpers used throughout the backend and worker
+
+def public_url(bucket_name: str, path: str) -> str:
+    return get_backend().url(bucket_name, path)
+
+def upload_file(file_path: str, bucket_name: str, destination_path: str) -> str:
+    """
+    Stores a file and returns its URL.
+    """
+    return get_backend().put(file_path, bucket_name, destination_path)
 
 def download_file(url: str, save_path: str):
     """
     Downloads a file from a URL to a local path.
     """
-    import requests
-    response = requests.get(url, stream=True)
-    if response.status_code == 200:
-        with open(save_path, 'wb') as f:
-            shutil.copyfileobj(response.raw, f)
-        return True
-    return False
+    return get_backend().get(url, save_path)
+
+async def upload_stream(chunks, bucket_name: str, destination_path: str, content_type: str) -> str:
+    """
+    Stores an async iterable of bytes as it arrives and returns its URL.
+    """
+    return await get_backend().put_stream(chunks, bucket_name, destination_path, content_type)
+
+def delete_files(bucket_name: str, paths: list) -> bool:
+    return get_backend().delete(bucket_name, paths)
+
+def local_path(url: str):
+    """
+    Local file behind a URL when storage is on this machine, else None.
+    """
+    return get_backend().local_path(url)
+
+def signed_upload(bucket_name: str, path: str, content_type: str, expires_in: int) -> dict:
+    return get_backend().signed_upload(bucket_name, path, content_type, expires_in)
+
+def head(url: str, size: int):
+    return get_backend().head(url, size)
@@ -0,0 +1,219 @@
+"""
+Streaming image uploads.
+
+Request bodies (multipart forms, or raw bodies PUT to a signed upload URL)
+are handed on chunk by chunk as they arrive. Multipart bodies go through
+python-multipart's push parser. An upload never has to be held in memory
+or spooled to disk by the API.
+"""
+import os
+import hashlib
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+# Lifetime of signed direct-upload URLs; uploads confirmed later are rejected
+UPLOAD_URL_EXPIRES_SECONDS = int(os.getenv("UPLOAD_URL_EXPIRES_SECONDS", "600"))
+
+# Leading bytes of the image formats accepted for uploads -> (extension, content type)
+IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", "jpg", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png", "image/png"),
+    (b"GIF87a", "gif", "image/gif"),
+    (b"GIF89a", "gif", "image/gif"),
+]
+SNIFF_BYTES = 12
+CONTENT_TYPE_EXTENSIONS = {content_type: ext for _, ext, content_type in IMAGE_SIGNATURES}
+CONTENT_TYPE_EXTENSIONS["image/webp"] = "webp"
+
+
+class UploadError(Exception):
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def sniff_image(head: bytes):
+    """
+    (extension, content type) of an image from its first bytes, or None.
+    """
+    for signature, ext, content_type in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return ext, content_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp", "image/webp"
+    return None
+
+
+class ImageStream:
+    """
+    Byte stream of one uploaded image, size-limited and hashed as it is read.
+
+        ext, content_type = await upload.start()   # validates the first bytes
+        async for chunk in upload: ...              # all bytes of the file
+        upload.sha256, upload.size
+    """
+
+    def __init__(self, max_bytes=MAX_UPLOAD_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.digest = hashlib.sha256()
+        self._head = b""
+
+    @property
+    def sha256(self):
+        return self.digest.hexdigest()
+
+    async def _read(self):
+        """
+        Next raw chunks of the file ([] at the end).
+        """
+        raise NotImplementedError
+
+    async def _next_chunks(self):
+        chunks = await self._read()
+        for chunk in chunks:
+            self.size += len(chunk)
+            if self.size > self.max_bytes:
+                raise UploadError(413, f"File too large (max {self.max_bytes / (1024 * 1024):.3g} MB)")
+            self.digest.update(chunk)
+        return chunks
+
+    async def start(self):
+        """
+        Reads up to the first SNIFF_BYTES of the file and checks that it is an image.
+        Returns (extension, content type).
+        """
+        while len(self._head) < SNIFF_BYTES:
+            chunks = await self._next_chunks()
+            if not chunks:
+                break
+            self._head += b"".join(chunks)
+        if not self._head:
+            raise UploadError(400, "Empty upload")
+        kind = sniff_image(self._head)
+        if kind is None:
+            raise UploadError(400, "Invalid file type. Only images are allowed.")
+        return kind
+
+    async def __aiter__(self):
+        if self._head:
+            yield self._head
+            self._head = b""
+        while True:
+            chunks = await self._next_chunks()
+            if not chunks:
+                return
+            for chunk in chunks:
+                yield chunk
+
+
+class RawImageStream(ImageStream):
+    """
+    A request body that is the file itself (e.g. a PUT to a signed upload URL).
+    """
+
+    def __init__(self, body, max_bytes=MAX_UPLOAD_BYTES):
+        super().__init__(max_bytes)
+        self.body = body.__aiter__()
+
+    async def _read(self):
+        while True:
+            try:
+                data = await self.body.__anext__()
+            except StopAsyncIteration:
+                return []
+            if data:
+                return [data]
+
+
+class FileFieldStream(ImageStream):
+    """
+    Pulls the content of one file field out of a multipart request stream:
+
+        upload = FileFieldStream(request.headers["content-type"], request.stream())
+    """
+
+    def __init__(self, content_type_header, body, field_name="file", max_bytes=MAX_UPLOAD_BYTES):
+        super().__init__(max_bytes)
+        content_type, params = parse_options_header(content_type_header or "")
+        boundary = params.get(b"boundary")
+        if content_type != b"multipart/form-data" or not boundary:
+            raise UploadError(400, "Expected multipart/form-data")
+
+        self.body = body.__aiter__()
+        self.field_name = field_name.encode()
+
+        self._chunks = []
+        self._header_field = b""
+        self._header_value = b""
+        self._headers = {}
+        self._in_field = False
+        self._field_done = False
+        self._body_done = False
+        self.parser = MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+
+    def _on_part_begin(self):
+        self._headers = {}
+
+    def _on_header_field(self, data, start, end):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, params = parse_options_header(self._headers.get(b"content-disposition", b""))
+        self._in_field = not self._field_done and params.get(b"name") == self.field_name
+
+    def _on_part_data(self, data, start, end):
+        if self._in_field:
+            self._chunks.append(bytes(data[start:end]))
+
+    def _on_part_end(self):
+        if self._in_field:
+            self._in_field = False
+            self._field_done = True
+
+    async def _read(self):
+        """
+        Feeds the parser until it produces file bytes.
+        """
+        while not self._chunks and not self._field_done and not self._body_done:
+            try:
+                data = await self.body.__anext__()
+            except StopAsyncIteration:
+                self._body_done = True
+                self.parser.finalize()
+                break
+            try:
+                self.parser.write(data)
+            except Exception as e:
+                raise UploadError(400, f"Malformed multipart body: {e}")
+        chunks, self._chunks = self._chunks, []
+        return chunks
+
+    async def start(self):
+        try:
+            return await super().start()
+        except UploadError as e:
+            if e.detail == "Empty upload":
+                raise UploadError(400, f"Missing file field '{self.field_name.decode()}'")
+            raise
@@ -0,0 +1,85 @@
+"""
+Measures what caching the source latent saves on a 30 s clip.
+
+Compares insightface's INSwapper.get (latent recomputed on every call)
+against FaceSwapper.swap with the latent computed once, on the same
+target face, for as many swaps as a 30 s clip needs (fps x 30 x faces).
+Both paste back with swap.paste_back_face, so only the latent differs.
+
+Usage: python benchmarks/bench_latent.py [source_image] [template_image] [fps]
+"""
+import sys
+import os
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'worker'))
+
+import cv2
+import numpy as np
+
+import tasks
+from insightface.utils import face_align
+from swap import paste_back_face
+
+UPLOADS = os.path.join(os.path.dirname(__file__), '..', 'backend', 'static', 'uploads')
+DEFAULT_SOURCE = os.path.join(UPLOADS, '0e4c380d-9939-4f80-b91a-dc0b399306ca.jpg')
+DEFAULT_TEMPLATE = os.path.join(UPLOADS, 'temp_template_2.jpg')
+CLIP_SECONDS = 30
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return time.perf_counter() - start
+
+
+def main():
+    source_path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_SOURCE
+    template_path = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_TEMPLATE
+    fps = float(sys.argv[3]) if len(sys.argv) > 3 else 30.0
+
+    source_face = tasks.get_source_face(source_path)
+    frame = cv2.imread(template_path)
+    target_faces = tasks.detect_faces(frame) if frame is not None else []
+    if source_face is None or not target_faces:
+        print("Need a readable source and template with at least one face each")
+        return
+
+    calls = int(fps * CLIP_SECONDS) * len(target_faces)
+    face = target_faces[0]
+    swapper = tasks.registry.swapper
+    face_swapper = tasks.registry.face_swapper
+    print(f"{calls} swaps ({fps:g} fps x {CLIP_SECONDS} s x {len(target_faces)} face(s))\n")
+
+    # paste_back_face only reads the aligned crop's size
+    aimg, _ = face_align.norm_crop2(frame, face.kps, swapper.input_size[0])
+
+    def uncached_swap():
+        bgr_fake, M = swapper.get(frame, face, source_face, paste_back=False)
+        paste_back_face(frame, bgr_fake, aimg, M)
+
+    def latent_per_call():
+        latent = source_face.normed_embedding.reshape((1, -1))
+        latent = np.dot(latent, swapper.emap)
+        latent /= np.linalg.norm(latent)
+
+    # Warm-up
+    uncached_swap()
+    latent = face_swapper.latent(source_face)
+    face_swapper.swap(frame, face, latent, paste_back=True)
+
+    latent_time = timed(latent_per_call, calls)
+    once_time = timed(lambda: face_swapper.latent(source_face), 1)
+    uncached = timed(uncached_swap, calls)
+    cached = timed(lambda: face_swapper.swap(frame, face, face_swapper.latent(source_face, key="bench"), paste_back=True), calls)
+
+    print(f"{'latent per call':<28}{latent_time * 1000:>10.1f} ms total  ({latent_time / calls * 1e6:.1f} us/call)")
+    print(f"{'latent once':<28}{once_time * 1000:>10.3f} ms total")
+    print(f"{'INSwapper.get':<28}{uncached:>10.2f} s  ({uncached / calls * 1000:.2f} ms/call)")
+    print(f"{'FaceSwapper.swap (cached)':<28}{cached:>10.2f} s  ({cached / calls * 1000:.2f} ms/call)")
+    print(f"\nSaving on a {CLIP_SECONDS} s clip: {(uncached - cached) * 1000:.0f} ms ({(1 - cached / uncached) * 100:.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
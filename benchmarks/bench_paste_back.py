@@ -0,0 +1,160 @@
+"""
+Per-frame time and peak RSS of paste-back at 720p and 1080p.
+
+Compares INSwapper's full-frame paste-back (frame.copy() plus several
+frame-sized float masks per face) with the in-place ROI paste-back in
+worker/swap.py. Each mode runs in its own subprocess so peak RSS is not
+shared between them. No models are needed: faces are placed synthetically.
+First checks that both produce the same frame, up to MAX_DIFF levels.
+
+Usage: python benchmarks/bench_paste_back.py [frames] [faces]
+"""
+import sys
+import os
+import json
+import resource
+import subprocess
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'worker'))
+
+import cv2
+import numpy as np
+from insightface.utils import face_align
+
+from swap import paste_back_face
+
+FIXTURE = os.path.join(os.path.dirname(__file__), '..', 'backend', 'static', 'uploads', 'temp_template_2.jpg')
+RESOLUTIONS = {"720p": (1280, 720), "1080p": (1920, 1080)}
+MODES = ["full-frame", "roi"]
+# Largest per-pixel difference allowed between the two paste-backs
+# (rounding vs truncation, and bilinear weights of the smaller warp)
+MAX_DIFF = 2
+
+
+def full_frame_paste_back(target_img, bgr_fake, aimg, M):
+    """
+    INSwapper.get's paste-back, as it ran before the ROI version.
+    """
+    fake_diff = bgr_fake.astype(np.float32) - aimg.astype(np.float32)
+    fake_diff = np.abs(fake_diff).mean(axis=2)
+    fake_diff[:2, :] = 0
+    fake_diff[-2:, :] = 0
+    fake_diff[:, :2] = 0
+    fake_diff[:, -2:] = 0
+    IM = cv2.invertAffineTransform(M)
+    img_white = np.full((aimg.shape[0], aimg.shape[1]), 255, dtype=np.float32)
+    bgr_fake = cv2.warpAffine(bgr_fake, IM, (target_img.shape[1], target_img.shape[0]), borderValue=0.0)
+    img_white = cv2.warpAffine(img_white, IM, (target_img.shape[1], target_img.shape[0]), borderValue=0.0)
+    fake_diff = cv2.warpAffine(fake_diff, IM, (target_img.shape[1], target_img.shape[0]), borderValue=0.0)
+    img_white[img_white > 20] = 255
+    fthresh = 10
+    fake_diff[fake_diff < fthresh] = 0
+    fake_diff[fake_diff >= fthresh] = 255
+    img_mask = img_white
+    mask_h_inds, mask_w_inds = np.where(img_mask == 255)
+    mask_h = np.max(mask_h_inds) - np.min(mask_h_inds)
+    mask_w = np.max(mask_w_inds) - np.min(mask_w_inds)
+    mask_size = int(np.sqrt(mask_h * mask_w))
+    k = max(mask_size // 10, 10)
+    img_mask = cv2.erode(img_mask, np.ones((k, k), np.uint8), iterations=1)
+    fake_diff = cv2.dilate(fake_diff, np.ones((2, 2), np.uint8), iterations=1)
+    k = max(mask_size // 20, 5)
+    img_mask = cv2.GaussianBlur(img_mask, (2 * k + 1, 2 * k + 1), 0)
+    fake_diff = cv2.GaussianBlur(fake_diff, (11, 11), 0)
+    img_mask /= 255
+    fake_diff /= 255
+    img_mask = np.reshape(img_mask, [img_mask.shape[0], img_mask.shape[1], 1])
+    fake_merged = img_mask * bgr_fake + (1 - img_mask) * target_img.astype(np.float32)
+    return fake_merged.astype(np.uint8)
+
+
+def synthetic_faces(width, height, count):
+    """
+    5-point keypoints of `count` faces, each about a third of the frame height.
+    """
+    face_size = height / 3
+    faces = []
+    for i in range(count):
+        offset = np.array([width * (i + 1) / (count + 1) - face_size / 2, height / 3])
+        faces.append(face_align.arcface_dst * (face_size / 112) + offset)
+    return faces
+
+
+def fixture(resolution, faces):
+    """
+    A frame and the (swapped crop, aligned crop, M) of each synthetic face.
+    """
+    width, height = RESOLUTIONS[resolution]
+    base = cv2.imread(FIXTURE)
+    base = cv2.resize(base, (width, height)) if base is not None else np.full((height, width, 3), 128, np.uint8)
+    rng = np.random.default_rng(0)
+    crops = []
+    for kps in synthetic_faces(width, height, faces):
+        aimg, M = face_align.norm_crop2(base, kps, 128)
+        crops.append((rng.integers(0, 255, aimg.shape, dtype=np.uint8), aimg, M))
+    return base, crops
+
+
+def check_equivalence(resolution, faces):
+    """
+    Largest per-pixel difference between the two paste-backs of one frame.
+    """
+    base, crops = fixture(resolution, faces)
+    expected = base.copy()
+    for bgr_fake, aimg, M in crops:
+        expected = full_frame_paste_back(expected, bgr_fake, aimg, M)
+    actual = base.copy()
+    for bgr_fake, aimg, M in crops:
+        paste_back_face(actual, bgr_fake, aimg, M)
+    return int(np.abs(expected.astype(np.int16) - actual.astype(np.int16)).max())
+
+
+def run(mode, resolution, frames, faces):
+    base, crops = fixture(resolution, faces)
+
+    times = []
+    for _ in range(frames):
+        frame = base.copy()  # stands in for the decoded frame
+        start = time.perf_counter()
+        if mode == "full-frame":
+            res = frame.copy()
+            for bgr_fake, aimg, M in crops:
+                res = full_frame_paste_back(res, bgr_fake, aimg, M)
+        else:
+            for bgr_fake, aimg, M in crops:
+                paste_back_face(frame, bgr_fake, aimg, M)
+        times.append(time.perf_counter() - start)
+
+    return {
+        "ms_per_frame": float(np.mean(times[1:] or times) * 1000),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--run":
+        mode, resolution, frames, faces = sys.argv[2], sys.argv[3], int(sys.argv[4]), int(sys.argv[5])
+        print(json.dumps(run(mode, resolution, frames, faces)))
+        return
+
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    faces = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    for resolution in RESOLUTIONS:
+        diff = check_equivalence(resolution, faces)
+        print(f"{resolution}: max difference from the full-frame paste-back {diff} (allowed {MAX_DIFF})")
+        assert diff <= MAX_DIFF, f"ROI paste-back differs by {diff} levels at {resolution}"
+    print(f"\n{frames} frames, {faces} face(s) per frame\n")
+    print(f"{'resolution':<12}{'mode':<12}{'ms/frame':>10}{'peak RSS MB':>13}")
+    for resolution in RESOLUTIONS:
+        for mode in MODES:
+            out = subprocess.run(
+                [sys.executable, __file__, "--run", mode, resolution, str(frames), str(faces)],
+                capture_output=True, text=True, check=True
+            )
+            result = json.loads(out.stdout.strip().splitlines()[-1])
+            print(f"{resolution:<12}{mode:<12}{result['ms_per_frame']:>10.2f}{result['peak_rss_mb']:>13.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Accuracy-vs-speed report for ONNX Runtime profiles and the int8 detector / swapper.
+
+Runs on the local fixtures in backend/static/uploads (or the images given on
+the command line) and prints markdown tables:
+  - detector / swapper latency for each ORT_PROFILE (fp32)
+  - fp32 vs int8: latency, detection recall and keypoint error, swapped-crop
+    PSNR, and identity similarity of the swapped face to the source face
+
+Usage: python benchmarks/bench_quantization.py [image ...]
+"""
+import sys
+import os
+import glob
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'worker'))
+
+import cv2
+import numpy as np
+import onnxruntime
+from insightface.utils import face_align
+from insightface.app.common import Face
+
+import model_registry
+from model_registry import ModelRegistry
+
+UPLOADS = os.path.join(os.path.dirname(__file__), '..', 'backend', 'static', 'uploads')
+DET_SIZE = (640, 640)
+PROFILES = ["default", "latency", "throughput"]
+
+
+def load(profile, int8):
+    providers = onnxruntime.get_available_providers()
+    ctx_id = 0 if 'CUDAExecutionProvider' in providers else -1
+    registry = ModelRegistry(providers, ctx_id, DET_SIZE, profile=profile,
+                             swapper_int8=int8, detector_int8=int8)
+    registry.load_all()
+    return registry
+
+
+def faces_of(registry, img):
+    bboxes, kpss = registry.detector.detect(img, max_num=0, metric='default')
+    return [Face(bbox=bboxes[i, :4], kps=kpss[i], det_score=bboxes[i, 4]) for i in range(len(bboxes))]
+
+
+def iou(a, b):
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def time_detect(registry, images):
+    start = time.perf_counter()
+    for img in images:
+        registry.detector.detect(img, max_num=0, metric='default')
+    return (time.perf_counter() - start) / len(images) * 1000
+
+
+def swap_crops(registry, crops, latent):
+    """
+    Returns (swapped crops, ms per crop).
+    """
+    model = registry.swapper
+    blobs = cv2.dnn.blobFromImages([c for c, _ in crops], 1.0 / model.input_std, model.input_size,
+                                   (model.input_mean,) * 3, swapRB=True)
+    start = time.perf_counter()
+    preds = np.concatenate([
+        model.session.run(model.output_names, {model.input_names[0]: blob[None], model.input_names[1]: latent})[0]
+        for blob in blobs
+    ])
+    elapsed = (time.perf_counter() - start) / len(crops) * 1000
+    swapped = np.clip(255 * preds.transpose((0, 2, 3, 1)), 0, 255).astype(np.uint8)[:, :, :, ::-1]
+    return list(swapped), elapsed
+
+
+def psnr(a, b):
+    mse = np.mean((a.astype(np.float32) - b.astype(np.float32)) ** 2)
+    return float("inf") if mse == 0 else 10 * np.log10(255.0 ** 2 / mse)
+
+
+def main():
+    paths = sys.argv[1:] or sorted(glob.glob(os.path.join(UPLOADS, '*.jpg')) + glob.glob(os.path.join(UPLOADS, '*.png')))
+    images = [img for img in (cv2.imread(p) for p in paths) if img is not None]
+    if not images:
+        print("No readable images")
+        return
+
+    ref = load("default", False)
+    targets = [(img, faces_of(ref, img)) for img in images]
+    source_img, source_faces = next(((img, faces) for img, faces in targets if faces), (None, []))
+    if not source_faces:
+        print("No faces found in the fixtures")
+        return
+    source_face = source_faces[0]
+    ref.recognizer.get(source_img, source_face)
+    latent = ref.face_swapper.latent(source_face)
+    crops = [face_align.norm_crop2(img, face.kps, 128) for img, faces in targets for face in faces]
+    print(f"{len(images)} images, {len(crops)} faces\n")
+
+    print("| profile | detect ms/img | swap ms/crop |")
+    print("|---|---|---|")
+    for profile in PROFILES:
+        registry = ref if profile == "default" else load(profile, False)
+        _, swap_ms = swap_crops(registry, crops, latent)
+        print(f"| {profile} | {time_detect(registry, images):.1f} | {swap_ms:.1f} |")
+
+    profile = model_registry.ORT_PROFILE
+    fp32 = ref if profile == "default" else load(profile, False)
+    int8 = load(profile, True)
+
+    rows = {}
+    for name, registry in (("fp32", fp32), ("int8", int8)):
+        matched, kps_err = 0, []
+        for img, ref_faces in targets:
+            faces = faces_of(registry, img)
+            for ref_face in ref_faces:
+                best = max(faces, key=lambda f: iou(f.bbox, ref_face.bbox), default=None)
+                if best is not None and iou(best.bbox, ref_face.bbox) > 0.5:
+                    matched += 1
+                    kps_err.append(np.linalg.norm(best.kps - ref_face.kps, axis=1).mean())
+
+        swapped, swap_ms = swap_crops(registry, crops, latent)
+        identity = []
+        for crop in swapped:
+            # 128px crops use the ArcFace template shifted 8px right, so this is an aligned 112px face
+            emb = ref.recognizer.get_feat(np.ascontiguousarray(crop[:112, 8:120]))[0]
+            identity.append(np.dot(emb / np.linalg.norm(emb), source_face.normed_embedding))
+        rows[name] = {
+            "detect_ms": time_detect(registry, images),
+            "recall": matched / len(crops),
+            "kps_err": float(np.mean(kps_err)) if kps_err else 0.0,
+            "swap_ms": swap_ms,
+            "swapped": swapped,
+            "identity": float(np.mean(identity)),
+        }
+
+    crop_psnr = np.mean([psnr(a, b) for a, b in zip(rows["fp32"]["swapped"], rows["int8"]["swapped"])])
+    print(f"\nProfile: {profile}\n")
+    print("| model | detect ms/img | recall vs fp32 | kps err px | swap ms/crop | PSNR vs fp32 dB | identity cos |")
+    print("|---|---|---|---|---|---|---|")
+    for name, row in rows.items():
+        row_psnr = "-" if name == "fp32" else f"{crop_psnr:.1f}"
+        print(f"| {name} | {row['detect_ms']:.1f} | {row['recall']:.3f} | {row['kps_err']:.2f} | "
+              f"{row['swap_ms']:.1f} | {row_psnr} | {row['identity']:.3f} |")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Download latency of storage.download_file against a local HTTP stand-in.
+
+Starts a keep-alive HTTP server on localhost that serves a generated file
+and fails every Nth request with a 503 or a connection cut mid-body, then
+compares:
+  - bare requests.get (the old download path: new connection per file, no retries)
+  - storage.download_file (pooled session, timeouts, retries with backoff)
+
+Usage: python benchmarks/bench_storage.py [downloads] [size_kb] [fail_every]
+"""
+import sys
+import os
+import shutil
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+import requests
+
+import storage
+
+
+class StandIn(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    body = b""
+    fail_every = 0
+    requests_seen = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with StandIn.lock:
+            StandIn.requests_seen += 1
+            n = StandIn.requests_seen
+        fail = StandIn.fail_every and n % StandIn.fail_every == 0
+        if fail and n % (2 * StandIn.fail_every) == 0:
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(StandIn.body)))
+        self.end_headers()
+        if fail:
+            # Cut the connection halfway through the body
+            self.wfile.write(StandIn.body[:len(StandIn.body) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(StandIn.body)
+
+    def log_message(self, *args):
+        pass
+
+
+def bare_download(url, path):
+    response = requests.get(url, stream=True)
+    if response.status_code != 200:
+        return False
+    with open(path, "wb") as f:
+        shutil.copyfileobj(response.raw, f)
+    return True
+
+
+def run(name, download, url, count, expected_size, temp_dir):
+    ok = 0
+    start = time.perf_counter()
+    for i in range(count):
+        path = os.path.join(temp_dir, f"{name}_{i}")
+        try:
+            if download(url, path) and os.path.getsize(path) == expected_size:
+                ok += 1
+        except Exception:
+            pass
+    elapsed = time.perf_counter() - start
+    print(f"{name:<22}{elapsed / count * 1000:>10.2f}{ok:>6}/{count}")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    size_kb = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+    fail_every = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+
+    StandIn.body = os.urandom(size_kb * 1024)
+    StandIn.fail_every = fail_every
+    storage.STORAGE_BACKOFF = 0.01
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/template.mp4"
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        print(f"{count} downloads of {size_kb} KB, failing every {fail_every or 'no'} request(s)\n")
+        print(f"{'client':<22}{'ms/file':>10}{'ok':>10}")
+        run("requests.get", bare_download, url, count, len(StandIn.body), temp_dir)
+        run("storage.download_file", storage.download_file, url, count, len(StandIn.body), temp_dir)
+    finally:
+        server.shutdown()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Compares every-frame detection against detect-every-N-frames + keypoint tracking.
+
+Reports throughput (fps) of the detection step and landmark drift: the mean
+distance between tracked keypoints and the keypoints the detector finds on
+the same frame, in pixels and as a fraction of the inter-ocular distance.
+
+Usage: python benchmarks/bench_tracking.py [video] [interval ...]
+"""
+import sys
+import os
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'worker'))
+
+import cv2
+import numpy as np
+
+import tasks
+from tracking import FaceTracker
+
+DEFAULT_VIDEO = os.path.join(os.path.dirname(__file__), '..', 'backend', 'static', 'uploads', '1768814639_297986.mp4')
+
+
+def load_frames(path, max_frames=300):
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        width, height = tasks.processing_size(frame.shape[1], frame.shape[0])
+        if height != frame.shape[0]:
+            frame = cv2.resize(frame, (width, height))
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def drift(reference, tracked):
+    """
+    Mean keypoint error (px, fraction of inter-ocular distance) of tracked faces
+    against the nearest reference face.
+    """
+    errors_px, errors_iod = [], []
+    for ref_faces, faces in zip(reference, tracked):
+        for face in faces:
+            if not ref_faces:
+                continue
+            center = face.kps.mean(axis=0)
+            ref = min(ref_faces, key=lambda f: np.linalg.norm(f.kps.mean(axis=0) - center))
+            err = np.linalg.norm(face.kps - ref.kps, axis=1).mean()
+            iod = max(np.linalg.norm(ref.kps[0] - ref.kps[1]), 1.0)
+            errors_px.append(err)
+            errors_iod.append(err / iod)
+    if not errors_px:
+        return 0.0, 0.0
+    return float(np.mean(errors_px)), float(np.mean(errors_iod))
+
+
+def main():
+    video = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_VIDEO
+    intervals = [int(v) for v in sys.argv[2:]] or [2, 5, 10]
+
+    frames = load_frames(video)
+    if not frames:
+        print(f"Could not read frames from {video}")
+        return
+    print(f"{len(frames)} frames at {frames[0].shape[1]}x{frames[0].shape[0]} from {video}\n")
+
+    # Warm-up so the first timed run doesn't pay session initialisation
+    tasks.detect_faces(frames[0])
+
+    start = time.perf_counter()
+    baseline = [tasks.detect_faces(frame) for frame in frames]
+    baseline_time = time.perf_counter() - start
+
+    print(f"{'mode':<16}{'fps':>8}{'speedup':>10}{'detections':>12}{'drift px':>10}{'drift iod':>11}")
+    print(f"{'every frame':<16}{len(frames) / baseline_time:>8.1f}{1.0:>10.2f}{len(frames):>12}{0.0:>10.2f}{0.0:>11.3f}")
+
+    for interval in intervals:
+        tracker = FaceTracker(tasks.detect_faces, interval=interval)
+        start = time.perf_counter()
+        tracked = [tracker.update(frame) for frame in frames]
+        elapsed = time.perf_counter() - start
+        err_px, err_iod = drift(baseline, tracked)
+        print(f"{'every ' + str(interval):<16}{len(frames) / elapsed:>8.1f}{baseline_time / elapsed:>10.2f}"
+              f"{tracker.detections:>12}{err_px:>10.2f}{err_iod:>11.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), 'backend'))
+
+from sqlalchemy import text
+from database import engine
+
+# Indexes added to tables that may already exist and hold data (create_all
+# only creates indexes together with new tables). Built CONCURRENTLY so
+# writes to the table are not blocked; run once per database, not at startup.
+INDEXES = [
+    # Keyset-paginated history: a user's tasks by (created_at, id)
+    ("ix_swap_tasks_user_created_id", "swap_tasks", "(user_id, created_at, id)"),
+    # Source upload lookups by URL when creating a swap
+    ("ix_uploads_url", "uploads", "(url)"),
+]
+
+def create_indexes():
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for name, table, columns in INDEXES:
+            # A concurrent build that failed leaves an INVALID index behind, which
+            # IF NOT EXISTS would skip: drop it and build again
+            invalid = conn.execute(text(
+                "SELECT 1 FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+                "WHERE c.relname = :name AND NOT i.indisvalid"
+            ), {"name": name}).first()
+            if invalid:
+                print(f"Dropping invalid index {name}")
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+            print(f"Creating index {name} on {table} {columns}...")
+            conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {columns}"))
+    print("Done.")
+
+if __name__ == "__main__":
+    create_indexes()
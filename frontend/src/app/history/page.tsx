@@ -13,22 +13,31 @@ interface SwapTask {
     result_url: string | null;
     status: string;
     created_at: string;
-    cost: number;
 }
 
 export default function HistoryPage() {
     const { getToken, isLoaded, isSignedIn } = useAuth();
     const [tasks, setTasks] = useState<SwapTask[]>([]);
     const [loading, setLoading] = useState(true);
+    const [nextCursor, setNextCursor] = useState<string | null>(null);
+    const [loadingMore, setLoadingMore] = useState(false);
+
+    // Pages come newest first; pass the previous page's cursor to continue
+    async function loadPage(cursor: string | null) {
+        const token = await getToken();
+        const params = new URLSearchParams({ limit: "24" });
+        if (cursor) params.set("cursor", cursor);
+        const data = await fetchWithAuth(`/swaps/history?${params}`, token);
+        setTasks((prev) => (cursor ? [...prev, ...data.items] : data.items));
+        setNextCursor(data.next_cursor);
+    }
 
     useEffect(() => {
         if (!isLoaded || !isSignedIn) return;
 
         async function loadHistory() {
             try {
-                const token = await getToken();
-                const data = await fetchWithAuth("/swaps/history", token);
-                setTasks(data.reverse()); // Newest first
+                await loadPage(null);
             } catch (error) {
                 console.error("Failed to load history", error);
             } finally {
@@ -39,6 +48,17 @@ export default function HistoryPage() {
         loadHistory();
     }, [isLoaded, isSignedIn]);
 
+    const loadMore = async () => {
+        setLoadingMore(true);
+        try {
+            await loadPage(nextCursor);
+        } catch (error) {
+            console.error("Failed to load history", error);
+        } finally {
+            setLoadingMore(false);
+        }
+    };
+
     if (!isLoaded || loading) {
         return (
             <div className="flex h-[50vh] items-center justify-center">
@@ -125,6 +145,19 @@ export default function HistoryPage() {
                     ))}
                 </div>
             )}
+
+            {nextCursor && (
+                <div className="flex justify-center mt-10">
+                    <button
+                        onClick={loadMore}
+                        disabled={loadingMore}
+                        className="bg-zinc-900 border border-white/10 px-6 py-2 rounded-full font-bold hover:bg-zinc-800 transition-colors disabled:opacity-50 flex items-center gap-2"
+                    >
+                        {loadingMore && <LucideLoader2 className="animate-spin" size={16} />}
+                        Load more
+                    </button>
+                </div>
+            )}
         </div>
     );
 }
@@ -5,7 +5,7 @@ import { useState, useEffect } from "react";
 import { LucideUpload, LucideZap, LucideCheckCircle, LucideLoader2, LucideAlertCircle } from "lucide-react";
 import Link from "next/link";
 import { useAuth } from "@clerk/nextjs";
-import { uploadFile, fetchWithAuth } from "@/lib/api";
+import { uploadFile, fetchWithAuth, watchTask, TaskEvent } from "@/lib/api";
 import { Template } from "@/types";
 
 export default function SwapPage() {
@@ -40,7 +40,6 @@ export default function SwapPage() {
 
     const [sourceFile, setSourceFile] = useState<File | null>(null);
     const [isSwapping, setIsSwapping] = useState(false);
-    // const [progress, setProgress] = useState(0); // Real progress is hard without websockets, we'll use a spinner or poll status
     const [result, setResult] = useState<string | null>(null);
     const [error, setError] = useState<string | null>(null);
     const [statusMessage, setStatusMessage] = useState<string>("");
@@ -83,26 +82,43 @@ export default function SwapPage() {
 
             const taskId = createRes.id;
 
-            // 3. Poll for result
+            // 3. Follow progress; poll if the event stream is unavailable
             setStatusMessage("Processing... (This may take 10-20 seconds)");
 
+            const finish = (task: TaskEvent) => {
+                setIsSwapping(false);
+                if (task.status === "COMPLETED" && task.result_url) {
+                    // Handle absolute URL (Supabase) vs relative URL (Local)
+                    const resultUrl = task.result_url.startsWith("http")
+                        ? task.result_url
+                        : (process.env.NEXT_PUBLIC_API_URL?.replace("/api/v1", "") || "http://localhost:8000") + task.result_url;
+
+                    setResult(resultUrl);
+                } else {
+                    setError(task.error_message || "Swap failed");
+                }
+            };
+
+            const final = await watchTask(taskId, token, (event) => {
+                if (event.status === "PROCESSING" && event.progress != null) {
+                    setStatusMessage(`Processing... ${Math.round(event.progress * 100)}%`);
+                }
+            }).catch((e) => {
+                console.warn("Progress stream unavailable, polling instead", e);
+                return null;
+            });
+            if (final) {
+                finish(final);
+                return;
+            }
+
             const pollInterval = setInterval(async () => {
                 try {
                     const task = await fetchWithAuth(`/swaps/${taskId}`, token);
 
-                    if (task.status === "COMPLETED") {
-                        clearInterval(pollInterval);
-                        setIsSwapping(false);
-                        // Handle absolute URL (Supabase) vs relative URL (Local)
-                        const resultUrl = task.result_url.startsWith("http")
-                            ? task.result_url
-                            : (process.env.NEXT_PUBLIC_API_URL?.replace("/api/v1", "") || "http://localhost:8000") + task.result_url;
-
-                        setResult(resultUrl);
-                    } else if (task.status === "FAILED") {
+                    if (task.status === "COMPLETED" || task.status === "FAILED") {
                         clearInterval(pollInterval);
-                        setIsSwapping(false);
-                        setError(task.error_message || "Swap failed");
+                        finish(task);
                     }
                 } catch (e) {
                     // Ignore transient polling errors
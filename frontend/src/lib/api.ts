@@ -19,7 +19,34 @@ export async function fetchWithAuth(url: string, token: string | null, options:
     return res.json();
 }
 
+function absoluteUrl(url: string) {
+    return url.startsWith("http") ? url : API_URL.replace("/api/v1", "") + url;
+}
+
+// Uploads straight to storage with a signed URL, then confirms with the API.
+// Falls back to streaming through the API if direct uploads are unavailable.
 export async function uploadFile(file: File, token: string) {
+    try {
+        const signed = await fetchWithAuth("/swaps/upload-url", token, {
+            method: "POST",
+            headers: { "Content-Type": "application/json" },
+            body: JSON.stringify({ content_type: file.type }),
+        });
+
+        const put = await fetch(absoluteUrl(signed.upload_url), {
+            method: signed.method,
+            headers: signed.headers,
+            body: file,
+        });
+        if (!put.ok) {
+            throw new Error("Direct upload failed");
+        }
+
+        return await fetchWithAuth(`/swaps/uploads/${signed.upload_id}/confirm`, token, { method: "POST" });
+    } catch (err) {
+        console.warn("Direct upload unavailable, uploading through the API", err);
+    }
+
     const formData = new FormData();
     formData.append("file", file);
 
@@ -37,3 +64,44 @@ export async function uploadFile(file: File, token: string) {
 
     return res.json();
 }
+
+export type TaskEvent = {
+    task_id: number;
+    status: "PENDING" | "PROCESSING" | "COMPLETED" | "FAILED";
+    progress: number | null;
+    result_url: string | null;
+    error_message: string | null;
+};
+
+// Follows a swap task's server-sent events until it completes or fails.
+// Uses fetch rather than EventSource so the token goes in a header.
+// Resolves with the last event, or null if the stream broke off early.
+export async function watchTask(taskId: number, token: string, onEvent: (event: TaskEvent) => void) {
+    const res = await fetch(`${API_URL}/swaps/${taskId}/events`, {
+        headers: { "Authorization": `Bearer ${token}` },
+    });
+    if (!res.ok || !res.body) {
+        return null;
+    }
+
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    let last: TaskEvent | null = null;
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let end;
+        while ((end = buffer.indexOf("\n\n")) !== -1) {
+            const message = buffer.slice(0, end);
+            buffer = buffer.slice(end + 2);
+            const data = message.split("\n").filter((line) => line.startsWith("data: ")).map((line) => line.slice(6)).join("\n");
+            if (!data) continue; // keep-alive
+            last = JSON.parse(data) as TaskEvent;
+            onEvent(last);
+        }
+    }
+    return last && (last.status === "COMPLETED" || last.status === "FAILED") ? last : null;
+}
@@ -13,6 +13,7 @@ from database import SessionLocal, engine
 import models
 import crud
 import schemas
+from celery_app import queue_template_analysis
 
 # Ensure tables exist
 models.Base.metadata.create_all(bind=engine)
@@ -61,7 +62,9 @@ def seed_templates():
                 thumbnail=t["thumbnail"],
                 cost=t["cost"]
             )
-            crud.create_template(db, template_create)
+            created = crud.create_template(db, template_create)
+            # Precompute its face index now rather than on the first swap
+            queue_template_analysis(created.id)
             print(f"Created template: {t['title']}")
             
         print("Seeding complete!")
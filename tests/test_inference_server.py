@@ -0,0 +1,51 @@
+import os
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'worker'))
+
+pytest.importorskip("insightface")
+pytest.importorskip("onnxruntime")
+
+from inference_server import InferenceServer, RemoteDetector
+
+
+class StubRetinaFace:
+    """
+    Same signature as insightface's RetinaFace.detect.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def detect(self, img, input_size=None, max_num=0, metric='default'):
+        if input_size is not None:
+            input_size[1]
+        self.calls.append((img.shape, input_size, max_num, metric))
+        return np.zeros((0, 5), dtype=np.float32), None
+
+
+class LoopbackClient:
+    """
+    Sends calls straight to a server's handler, as InferenceClient does over the socket.
+    """
+
+    def __init__(self, server):
+        self.server = server
+
+    def call(self, op, *args):
+        return self.server.handle(op, args)
+
+
+def test_remote_detect_passes_arguments_by_name():
+    detector = StubRetinaFace()
+    server = InferenceServer(SimpleNamespace(detector=detector), authkey=b"test")
+    img = np.zeros((64, 64, 3), dtype=np.uint8)
+
+    bboxes, kpss = RemoteDetector(LoopbackClient(server)).detect(img, max_num=2, metric='max')
+
+    assert bboxes.shape == (0, 5)
+    assert detector.calls == [((64, 64, 3), None, 2, 'max')]
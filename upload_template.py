@@ -10,6 +10,7 @@ import schemas
 from database import SessionLocal, engine
 import models
 import crud
+from celery_app import queue_template_analysis
 
 # Make sure tables exist (and update schema if needed - SQLAlchemy won't auto-migrate columns though)
 # Since we added a column, simpler way in dev is to let user know or use SQL.
@@ -83,6 +84,8 @@ def upload_template(file_path, title, type="VIDEO", cost=10, thumbnail_url=None)
             cost=cost
         )
         created = crud.create_template(db, t)
+        # Precompute its face index now rather than on the first swap
+        queue_template_analysis(created.id)
         print(f"Success! Template '{created.title}' added with ID: {created.id}")
     except Exception as e:
         print(f"Database Error: {e}")
@@ -0,0 +1,153 @@
+import os
+import subprocess
+
+import numpy as np
+
+# x264 tunables for result videos
+VIDEO_PRESET = os.getenv("VIDEO_PRESET", "medium")
+VIDEO_CRF = int(os.getenv("VIDEO_CRF", "23"))
+VIDEO_THREADS = int(os.getenv("VIDEO_THREADS", "0"))  # 0 = let x264 decide
+
+
+def probe_audio_codec(path):
+    """
+    Returns the codec name of the first audio stream (e.g. "aac"), or None if there is no audio.
+    """
+    probe = subprocess.run(
+        ['ffprobe', '-v', 'error', '-select_streams', 'a:0', '-show_entries', 'stream=codec_name',
+         '-of', 'default=noprint_wrappers=1:nokey=1', path],
+        capture_output=True, text=True
+    )
+    codec = probe.stdout.strip()
+    return codec or None
+
+
+class FFmpegWriter:
+    """
+    Encodes BGR frames piped as rawvideo into a single ffmpeg process that
+    also muxes the audio of `audio_source`, so every frame is encoded once.
+    AAC audio is stream-copied, anything else is re-encoded to AAC.
+    """
+
+    def __init__(self, output_path, width, height, fps, audio_source=None,
+                 preset=VIDEO_PRESET, crf=VIDEO_CRF, threads=VIDEO_THREADS):
+        self.frame_shape = (height, width, 3)
+        cmd = [
+            'ffmpeg', '-y', '-hide_banner', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}',
+            '-r', str(fps if fps and fps > 0 else 25), '-i', '-',
+        ]
+
+        audio_codec = probe_audio_codec(audio_source) if audio_source else None
+        if audio_codec:
+            cmd.extend(['-i', audio_source, '-map', '0:v:0', '-map', '1:a:0'])
+            cmd.extend(['-c:a', 'copy' if audio_codec == 'aac' else 'aac'])
+        else:
+            cmd.extend(['-map', '0:v:0'])
+
+        if width % 2 or height % 2:
+            # yuv420p needs even dimensions
+            cmd.extend(['-vf', 'crop=trunc(iw/2)*2:trunc(ih/2)*2'])
+
+        cmd.extend([
+            '-c:v', 'libx264',
+            '-preset', preset,
+            '-crf', str(crf),
+            '-threads', str(threads),
+            '-pix_fmt', 'yuv420p', # Ensure compatibility
+            '-movflags', '+faststart',
+            '-shortest', # Stop when the shortest stream ends
+            output_path
+        ])
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+    def write(self, frame):
+        if frame.shape != self.frame_shape:
+            raise ValueError(f"Frame shape {frame.shape} does not match encoder {self.frame_shape}")
+        # Hand the frame's buffer to the pipe without an intermediate bytes copy
+        self.proc.stdin.write(memoryview(np.ascontiguousarray(frame)).cast('B'))
+
+    def close(self):
+        """
+        Finishes the stream and returns True if ffmpeg exited cleanly.
+        """
+        try:
+            self.proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        return self.proc.wait() == 0
+
+    def abort(self):
+        self.proc.kill()
+        self.proc.wait()
+
+
+def probe_duration(path):
+    """
+    Container duration in seconds (0.0 if unknown).
+    """
+    probe = subprocess.run(
+        ['ffprobe', '-v', 'error', '-show_entries', 'format=duration',
+         '-of', 'default=noprint_wrappers=1:nokey=1', path],
+        capture_output=True, text=True
+    )
+    try:
+        return float(probe.stdout.strip())
+    except ValueError:
+        return 0.0
+
+
+def probe_frame_count(path):
+    """
+    Number of video frames, counted from the packets (no decoding). 0 if unknown.
+    """
+    probe = subprocess.run(
+        ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-count_packets',
+         '-show_entries', 'stream=nb_read_packets',
+         '-of', 'default=noprint_wrappers=1:nokey=1', path],
+        capture_output=True, text=True
+    )
+    try:
+        return int(probe.stdout.strip())
+    except ValueError:
+        return 0
+
+
+def split_video(path, output_dir, segment_seconds):
+    """
+    Cuts a video into ~segment_seconds chunks without re-encoding. With stream
+    copy the segment muxer can only cut on keyframes, so every chunk decodes on its own.
+    Returns the chunk paths in playback order.
+    """
+    pattern = os.path.join(output_dir, 'segment_%03d.mp4')
+    subprocess.run([
+        'ffmpeg', '-y', '-hide_banner', '-loglevel', 'error',
+        '-i', path,
+        '-map', '0:v:0', '-map', '0:a:0?',
+        '-c', 'copy',
+        '-f', 'segment', '-segment_time', f'{segment_seconds:.3f}', '-reset_timestamps', '1',
+        pattern
+    ], check=True)
+    return sorted(
+        os.path.join(output_dir, name) for name in os.listdir(output_dir)
+        if name.startswith('segment_') and name.endswith('.mp4')
+    )
+
+
+def concat_videos(paths, output_path):
+    """
+    Joins segments encoded with identical settings using the concat demuxer (no re-encode).
+    """
+    list_path = output_path + '.txt'
+    with open(list_path, 'w') as f:
+        for path in paths:
+            f.write(f"file '{os.path.abspath(path)}'\n")
+    try:
+        subprocess.run([
+            'ffmpeg', '-y', '-hide_banner', '-loglevel', 'error',
+            '-f', 'concat', '-safe', '0', '-i', list_path,
+            '-c', 'copy', '-movflags', '+faststart',
+            output_path
+        ], check=True)
+    finally:
+        os.remove(list_path)
@@ -0,0 +1,263 @@
+"""
+Host-wide inference server.
+
+With Celery's prefork pool every child process would hold its own copy of
+the ONNX sessions. Instead, one server process per host owns them and the
+task processes send it frames / aligned crops over a local Unix socket.
+Swap requests from concurrently running tasks are batched together.
+
+Run next to the worker:
+    INFERENCE_AUTHKEY=<secret> python worker/inference_server.py
+and start the worker with INFERENCE_SERVER=<socket path> and the same
+INFERENCE_AUTHKEY. Messages are pickled, so the key is what keeps other
+local users from running code in either process; there is no default.
+"""
+import sys
+import os
+import time
+import queue
+import threading
+from types import SimpleNamespace
+from multiprocessing.connection import Listener, Client
+
+import numpy as np
+from insightface.app.common import Face
+
+from swap import FaceSwapper
+
+INFERENCE_SOCKET = os.getenv("INFERENCE_SOCKET", "/tmp/faceswap-inference.sock")
+INFERENCE_AUTHKEY = os.getenv("INFERENCE_AUTHKEY", "").encode()
+# Swap requests are held this long to be batched with requests from other tasks
+INFERENCE_BATCH_WAIT_MS = float(os.getenv("INFERENCE_BATCH_WAIT_MS", "5"))
+INFERENCE_MAX_BATCH = int(os.getenv("INFERENCE_MAX_BATCH", "32"))
+
+
+def require_authkey(authkey):
+    if not authkey:
+        raise RuntimeError("INFERENCE_AUTHKEY must be set (same value for the inference server and the worker)")
+    return authkey
+
+
+class SwapBatcher:
+    """
+    Collects swap requests from all connections and runs them through the
+    swapper together: up to max_batch crops, waiting at most max_wait seconds.
+    """
+
+    def __init__(self, face_swapper, max_batch=INFERENCE_MAX_BATCH, max_wait=INFERENCE_BATCH_WAIT_MS / 1000):
+        self.face_swapper = face_swapper
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        threading.Thread(target=self._loop, name="swap-batcher", daemon=True).start()
+
+    def submit(self, blobs, latents):
+        request = SimpleNamespace(blobs=blobs, latents=latents, done=threading.Event(), result=None, error=None)
+        self.requests.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _loop(self):
+        while True:
+            batch = [self.requests.get()]
+            size = len(batch[0].blobs)
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self.requests.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(request)
+                size += len(request.blobs)
+
+            try:
+                preds = self.face_swapper.run(
+                    np.concatenate([r.blobs for r in batch]),
+                    np.concatenate([r.latents for r in batch]),
+                )
+                start = 0
+                for request in batch:
+                    request.result = preds[start:start + len(request.blobs)]
+                    start += len(request.blobs)
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+            for request in batch:
+                request.done.set()
+
+
+class InferenceServer:
+    def __init__(self, registry, address=INFERENCE_SOCKET, authkey=INFERENCE_AUTHKEY):
+        self.registry = registry
+        self.address = address
+        self.authkey = require_authkey(authkey)
+        self.batcher = None
+
+    def info(self):
+        swapper = self.registry.swapper
+        return {
+            "input_size": swapper.input_size,
+            "input_mean": swapper.input_mean,
+            "input_std": swapper.input_std,
+            "emap": swapper.emap,
+            "batch_size": self.registry.face_swapper.batch_size,
+        }
+
+    def handle(self, op, args):
+        if op == "detect":
+            # By name: RetinaFace.detect takes input_size before max_num
+            img, max_num, metric = args
+            return self.registry.detector.detect(img, max_num=max_num, metric=metric)
+        if op == "embed":
+            img, kps = args
+            face = Face(kps=kps)
+            self.registry.recognizer.get(img, face)
+            return face.embedding
+        if op == "swap":
+            return self.batcher.submit(*args)
+        if op == "info":
+            return self.info()
+        if op == "stats":
+            return self.registry.stats
+        raise ValueError(f"Unknown op {op}")
+
+    def serve_connection(self, conn):
+        with conn:
+            while True:
+                try:
+                    op, args = conn.recv()
+                except EOFError:
+                    return
+                try:
+                    conn.send(("ok", self.handle(op, args)))
+                except Exception as e:
+                    conn.send(("error", f"{type(e).__name__}: {e}"))
+
+    def serve_forever(self):
+        self.registry.load_all()
+        self.batcher = SwapBatcher(self.registry.face_swapper)
+        if os.path.exists(self.address):
+            os.remove(self.address)
+        # Create the socket owner-only from the start, rather than chmod after bind
+        umask = os.umask(0o077)
+        try:
+            listener = Listener(self.address, family="AF_UNIX", authkey=self.authkey)
+        finally:
+            os.umask(umask)
+        with listener:
+            print(f"Inference server listening on {self.address}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    print(f"Rejected inference client: {e}")
+                    continue
+                threading.Thread(target=self.serve_connection, args=(conn,), daemon=True).start()
+
+
+class InferenceClient:
+    """
+    One connection per thread, so the pipeline stages of a task can call concurrently.
+    """
+
+    def __init__(self, address=INFERENCE_SOCKET, authkey=INFERENCE_AUTHKEY):
+        self.address = address
+        self.authkey = require_authkey(authkey)
+        self._local = threading.local()
+
+    def call(self, op, *args):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = Client(self.address, family="AF_UNIX", authkey=self.authkey)
+        try:
+            conn.send((op, args))
+            status, value = conn.recv()
+        except (EOFError, OSError):
+            self._local.conn = None
+            raise
+        if status != "ok":
+            raise RuntimeError(f"Inference server error: {value}")
+        return value
+
+
+class RemoteDetector:
+    def __init__(self, client):
+        self.client = client
+
+    def detect(self, img, max_num=0, metric='default'):
+        return self.client.call("detect", img, max_num, metric)
+
+
+class RemoteRecognizer:
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, img, face):
+        face.embedding = self.client.call("embed", img, face.kps)
+        return face.embedding
+
+
+class RemoteFaceSwapper(FaceSwapper):
+    """
+    FaceSwapper whose inference runs on the server; alignment and paste-back stay in the task.
+    """
+
+    def __init__(self, client, info):
+        self.client = client
+        # Everything FaceSwapper needs outside of run(); there is no local session
+        model = SimpleNamespace(
+            emap=info["emap"], input_size=info["input_size"],
+            input_mean=info["input_mean"], input_std=info["input_std"],
+            session=None,
+        )
+        super().__init__(model, batch_size=info["batch_size"])
+
+    def _load_batch_session(self):
+        # The server runs the batched session
+        return None
+
+    def run(self, blobs, latents):
+        return self.client.call("swap", blobs, latents)
+
+
+class RemoteRegistry:
+    """
+    Drop-in for ModelRegistry that forwards inference to the host's inference server.
+    """
+
+    def __init__(self, address=INFERENCE_SOCKET):
+        self.client = InferenceClient(address)
+        self.detector = RemoteDetector(self.client)
+        self.recognizer = RemoteRecognizer(self.client)
+        self._face_swapper = None
+        self._lock = threading.Lock()
+
+    @property
+    def face_swapper(self):
+        with self._lock:
+            if self._face_swapper is None:
+                self._face_swapper = RemoteFaceSwapper(self.client, self.client.call("info"))
+        return self._face_swapper
+
+    @property
+    def stats(self):
+        return self.client.call("stats")
+
+    def load_all(self):
+        self.face_swapper
+        return self.stats
+
+
+if __name__ == "__main__":
+    import onnxruntime
+    from model_registry import ModelRegistry
+
+    providers = onnxruntime.get_available_providers()
+    ctx_id = 0 if 'CUDAExecutionProvider' in providers else -1
+    address = sys.argv[1] if len(sys.argv) > 1 else INFERENCE_SOCKET
+    InferenceServer(ModelRegistry(providers, ctx_id, (640, 640)), address).serve_forever()
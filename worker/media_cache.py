@@ -0,0 +1,204 @@
+"""
+Worker-local disk cache of template media.
+
+The same few templates are used by most tasks, so instead of downloading
+them into every task's temp dir they are kept in MEDIA_CACHE_DIR:
+  - least recently used files are evicted above MEDIA_CACHE_MAX_GB
+  - cached copies are revalidated with a conditional GET (ETag /
+    Last-Modified) at most every MEDIA_CACHE_REVALIDATE_SECONDS
+  - fills and evictions take fcntl locks, so concurrent Celery children
+    never download the same file twice or see a partial file
+  - tasks get a hardlink of the cached file (a copy only across filesystems)
+"""
+import os
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import tempfile
+from contextlib import contextmanager
+
+MEDIA_CACHE_DIR = os.getenv(
+    "MEDIA_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "faceswap_media_cache"),
+)
+# 0 disables the cache
+MEDIA_CACHE_MAX_GB = float(os.getenv("MEDIA_CACHE_MAX_GB", "5"))
+MEDIA_CACHE_REVALIDATE_SECONDS = float(os.getenv("MEDIA_CACHE_REVALIDATE_SECONDS", "300"))
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def enabled():
+    return MEDIA_CACHE_MAX_GB > 0
+
+
+@contextmanager
+def _locked(path):
+    """
+    Exclusive advisory lock on `path`, held across processes.
+    """
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _extension(url):
+    ext = url.split("?")[0].split(".")[-1]
+    return "mp4" if len(ext) > 4 or "/" in ext else ext
+
+
+class CacheEntry:
+    def __init__(self, url):
+        self.url = url
+        key = hashlib.sha256(url.encode()).hexdigest()[:32]
+        base = os.path.join(MEDIA_CACHE_DIR, key)
+        self.data_path = f"{base}.{_extension(url)}"
+        self.meta_path = f"{base}.json"
+        self.lock_path = f"{base}.lock"
+
+    def read_meta(self):
+        try:
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+            # A data file that does not match its metadata (e.g. evicted in between) is a miss
+            if os.path.getsize(self.data_path) != meta["size"]:
+                return None
+            return meta
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def write_meta(self, meta):
+        fd, tmp_path = tempfile.mkstemp(dir=MEDIA_CACHE_DIR, suffix=".json.tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def touch(self):
+        # The data file's mtime is the LRU clock
+        try:
+            os.utime(self.data_path)
+        except OSError:
+            pass
+
+
+def _download(session, entry, meta):
+    """
+    Conditional GET into the cache. Returns the (new or revalidated) metadata.
+    """
+    headers = {}
+    if meta is not None:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    import storage
+    with session.get(entry.url, headers=headers, stream=True, timeout=storage.timeout()) as response:
+        if response.status_code == 304 and meta is not None:
+            meta["checked_at"] = time.time()
+            entry.write_meta(meta)
+            return meta
+        response.raise_for_status()
+
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=MEDIA_CACHE_DIR, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+            os.replace(tmp_path, entry.data_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    meta = {
+        "url": entry.url,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "size": size,
+        "sha256": digest.hexdigest(),
+        "checked_at": time.time(),
+    }
+    entry.write_meta(meta)
+    return meta
+
+
+def _evict(keep):
+    """
+    Deletes least recently used entries until the cache fits MEDIA_CACHE_MAX_GB.
+    Tasks holding a hardlink or an open file are unaffected.
+    """
+    limit = MEDIA_CACHE_MAX_GB * 1024 ** 3
+    with _locked(os.path.join(MEDIA_CACHE_DIR, ".evict.lock")):
+        entries = []
+        total = 0
+        for name in os.listdir(MEDIA_CACHE_DIR):
+            path = os.path.join(MEDIA_CACHE_DIR, name)
+            if name.startswith(".") or name.endswith((".json", ".lock", ".tmp", ".part")):
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+
+        for _, size, path in sorted(entries):
+            if total <= limit:
+                break
+            if path == keep:
+                continue
+            base = os.path.splitext(path)[0]
+            with _locked(f"{base}.lock"):
+                for stale in (path, f"{base}.json"):
+                    try:
+                        os.remove(stale)
+                    except OSError:
+                        pass
+            total -= size
+            print(f"Media cache: evicted {os.path.basename(path)} ({size / 1024 ** 2:.0f} MB)")
+
+
+def fetch(url, dest_dir, stem, session=None):
+    """
+    Makes the media at `url` available as dest_dir/<stem>.<ext> through the cache.
+    Returns (path, sha256 of the content).
+    """
+    if session is None:
+        import storage
+        session = storage.http_session()
+    os.makedirs(MEDIA_CACHE_DIR, exist_ok=True)
+    entry = CacheEntry(url)
+
+    with _locked(entry.lock_path):
+        meta = entry.read_meta()
+        if meta is None:
+            print(f"Media cache: miss for {url}")
+            meta = _download(session, entry, None)
+        elif time.time() - meta.get("checked_at", 0) > MEDIA_CACHE_REVALIDATE_SECONDS:
+            try:
+                meta = _download(session, entry, meta)
+                print(f"Media cache: revalidated {url}")
+            except Exception as e:
+                # Storage unreachable: the last validated copy is better than failing the task
+                print(f"Media cache: could not revalidate {url}, using cached copy: {e}")
+        else:
+            print(f"Media cache: hit for {url}")
+        entry.touch()
+
+        path = os.path.join(dest_dir, f"{stem}.{_extension(url)}")
+        try:
+            os.link(entry.data_path, path)
+        except OSError:
+            shutil.copyfile(entry.data_path, path)
+
+    _evict(keep=entry.data_path)
+    return path, meta["sha256"]
@@ -0,0 +1,208 @@
+import os
+import time
+import threading
+
+import numpy as np
+import onnxruntime
+from insightface.model_zoo.arcface_onnx import ArcFaceONNX
+from insightface.model_zoo.inswapper import INSwapper
+from insightface.model_zoo.retinaface import RetinaFace
+from insightface.utils import ensure_available, download_onnx
+
+from swap import FaceSwapper
+
+# Only the buffalo_l models the swap uses; landmark_3d_68 / 2d106 / genderage are never loaded
+MODEL_PACK = "buffalo_l"
+PACK_FILES = {
+    "detection": "det_10g.onnx",
+    "recognition": "w600k_r50.onnx",
+}
+SWAPPER_FILE = "inswapper_128.onnx"
+
+# Run one dummy inference right after loading so the first task doesn't pay for it
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "1") == "1"
+
+# ONNX Runtime session profile for all models: "default", "latency" or "throughput".
+# ORT_INTRA_OP_THREADS / ORT_INTER_OP_THREADS override the profile's thread counts.
+ORT_PROFILE = os.getenv("ORT_PROFILE", "default")
+
+# Use dynamically quantized int8 copies of the swapper / detector (written next to the originals)
+SWAPPER_INT8 = os.getenv("SWAPPER_INT8", "0") == "1"
+DETECTOR_INT8 = os.getenv("DETECTOR_INT8", "0") == "1"
+
+
+def session_options(profile=ORT_PROFILE):
+    """
+    onnxruntime.SessionOptions for a named performance profile.
+
+    - latency: one inference at a time using every core (single task per worker).
+    - throughput: few threads per inference and no spin-waiting, for many
+      concurrent inferences (pipeline workers, prefork children, inference server).
+    """
+    opts = onnxruntime.SessionOptions()
+    opts.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    cpus = os.cpu_count() or 1
+    if profile == "latency":
+        opts.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+        opts.intra_op_num_threads = cpus
+        opts.inter_op_num_threads = 1
+    elif profile == "throughput":
+        opts.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+        opts.intra_op_num_threads = min(2, cpus)
+        opts.inter_op_num_threads = 1
+        opts.add_session_config_entry("session.intra_op.allow_spinning", "0")
+        opts.add_session_config_entry("session.inter_op.allow_spinning", "0")
+    elif profile != "default":
+        raise ValueError(f"Unknown ORT_PROFILE {profile!r} (expected default, latency or throughput)")
+
+    if os.getenv("ORT_INTRA_OP_THREADS"):
+        opts.intra_op_num_threads = int(os.getenv("ORT_INTRA_OP_THREADS"))
+    if os.getenv("ORT_INTER_OP_THREADS"):
+        opts.inter_op_num_threads = int(os.getenv("ORT_INTER_OP_THREADS"))
+    return opts
+
+
+def quantized_model(model_path):
+    """
+    Path of a dynamically quantized (int8 weights) copy of an ONNX model, created on first use.
+    """
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    int8_path = os.path.splitext(model_path)[0] + ".int8.onnx"
+    if not os.path.exists(int8_path):
+        tmp_path = f"{int8_path}.{os.getpid()}.tmp"
+        quantize_dynamic(model_path, tmp_path, weight_type=QuantType.QUInt8)
+        os.replace(tmp_path, int8_path)
+    return int8_path
+
+
+def resident_memory_mb():
+    """
+    Current resident set size of this process in MB.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError):
+        import resource
+        # ru_maxrss is KB on Linux (peak, not current, but better than nothing)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class ModelRegistry:
+    """
+    Loads detection, recognition and the swapper lazily, on first use, and
+    records how long each took and how much resident memory it added.
+    Safe to use from several threads.
+    """
+
+    def __init__(self, providers, ctx_id, det_size, profile=ORT_PROFILE,
+                 swapper_int8=SWAPPER_INT8, detector_int8=DETECTOR_INT8):
+        self.providers = providers
+        self.ctx_id = ctx_id
+        self.det_size = det_size
+        self.profile = profile
+        self.swapper_int8 = swapper_int8
+        self.detector_int8 = detector_int8
+        self.stats = {}
+        self._models = {}
+        self._lock = threading.RLock()
+
+    def _load(self, name, loader, warmup):
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        with self._lock:
+            model = self._models.get(name)
+            if model is None:
+                rss_before = resident_memory_mb()
+                start = time.perf_counter()
+                model = loader()
+                load_time = time.perf_counter() - start
+                warmup_time = 0.0
+                if MODEL_WARMUP:
+                    start = time.perf_counter()
+                    warmup(model)
+                    warmup_time = time.perf_counter() - start
+                rss = resident_memory_mb() - rss_before
+                self.stats[name] = {"load_s": load_time, "warmup_s": warmup_time, "rss_mb": rss}
+                print(f"Loaded {name} in {load_time:.2f}s (warm-up {warmup_time:.2f}s, +{rss:.0f} MB RSS)")
+                self._models[name] = model
+        return model
+
+    def _pack_file(self, task):
+        model_dir = ensure_available("models", MODEL_PACK, root="~/.insightface")
+        return os.path.join(model_dir, PACK_FILES[task])
+
+    def session(self, model_path):
+        return onnxruntime.InferenceSession(
+            model_path, sess_options=session_options(self.profile), providers=self.providers
+        )
+
+    @property
+    def detector(self):
+        def load():
+            model_file = self._pack_file("detection")
+            session_file = quantized_model(model_file) if self.detector_int8 else model_file
+            model = RetinaFace(model_file=model_file, session=self.session(session_file))
+            model.prepare(self.ctx_id, input_size=self.det_size)
+            return model
+
+        def warmup(model):
+            model.detect(np.zeros((self.det_size[1], self.det_size[0], 3), dtype=np.uint8), max_num=0, metric='default')
+
+        return self._load("detection", load, warmup)
+
+    @property
+    def recognizer(self):
+        def load():
+            model_file = self._pack_file("recognition")
+            model = ArcFaceONNX(model_file=model_file, session=self.session(model_file))
+            model.prepare(self.ctx_id)
+            return model
+
+        def warmup(model):
+            model.get_feat(np.zeros((112, 112, 3), dtype=np.uint8))
+
+        return self._load("recognition", load, warmup)
+
+    @property
+    def swapper(self):
+        def load():
+            model_file = download_onnx("models", SWAPPER_FILE, root="~/.insightface")
+            session_file = quantized_model(model_file) if self.swapper_int8 else model_file
+            # INSwapper reads emap from model_file, so that always stays the fp32 original
+            model = INSwapper(model_file=model_file, session=self.session(session_file))
+            model.session_file = session_file
+            return model
+
+        def warmup(model):
+            blob = np.zeros((1, 3) + tuple(model.input_size[::-1]), dtype=np.float32)
+            latent = np.zeros((1, model.emap.shape[1]), dtype=np.float32)
+            model.session.run(model.output_names, {model.input_names[0]: blob, model.input_names[1]: latent})
+
+        return self._load("swapper", load, warmup)
+
+    @property
+    def face_swapper(self):
+        swapper = self.swapper
+        # Covers the batch-enabled swapper session, if any
+        return self._load("face_swapper", lambda: FaceSwapper(swapper, session_factory=self.session), lambda model: None)
+
+    def load_all(self):
+        self.detector
+        self.recognizer
+        self.face_swapper
+        return self.stats
+
+
+if __name__ == "__main__":
+    # Report load time and resident memory of each model: python worker/model_registry.py
+    providers = onnxruntime.get_available_providers()
+    registry = ModelRegistry(providers, 0 if 'CUDAExecutionProvider' in providers else -1, (640, 640))
+    baseline = resident_memory_mb()
+    stats = registry.load_all()
+    print(f"\n{'model':<14}{'load s':>8}{'warm-up s':>11}{'RSS MB':>9}")
+    for name, stat in stats.items():
+        print(f"{name:<14}{stat['load_s']:>8.2f}{stat['warmup_s']:>11.2f}{stat['rss_mb']:>9.0f}")
+    print(f"{'total':<14}{'':>8}{'':>11}{resident_memory_mb() - baseline:>9.0f}")
@@ -0,0 +1,197 @@
+import threading
+import queue
+
+_DONE = object()
+
+
+class _Window:
+    """
+    Sequence number an in-order consumer is waiting for. Producers feeding
+    multi-worker stages wait on it, so at most `size` items are in flight
+    between them and that consumer, reorder buffer included.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.next_seq = 0
+        self.cond = threading.Condition()
+
+    def advance(self, next_seq):
+        with self.cond:
+            self.next_seq = next_seq
+            self.cond.notify_all()
+
+    def admit(self, seq, stop):
+        with self.cond:
+            while seq >= self.next_seq + self.size:
+                if stop.is_set():
+                    return False
+                self.cond.wait(0.1)
+        return True
+
+
+def run_pipeline(source, stages, sink, queue_size=8):
+    """
+    Runs source -> stages -> sink with every step overlapping the others.
+
+    - `source` is iterated in its own thread (e.g. decoding frames).
+    - `stages` is a list of (fn, workers) or (fn, workers, batch_size); each
+      stage gets `workers` threads pulling from a bounded queue, so a slow stage
+      applies backpressure to everything upstream instead of buffering the whole
+      video. With batch_size > 1, fn receives a list of whatever is queued (up
+      to batch_size items) and returns a list of results.
+    - Single-worker unbatched stages and `sink` receive items in source order, so they can
+      keep state (tracking, encoding); multi-worker stages may finish out of order.
+      Items are only fed to multi-worker stages while the next in-order step
+      holds fewer than queue_size items, so one slow item does not let its
+      reorder buffer grow without bound.
+    - `sink` runs in the calling thread. The first exception anywhere stops
+      the pipeline and is re-raised here.
+    """
+    stop = threading.Event()
+    errors = []
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+    threads = []
+
+    # ordered[i]: queue i is consumed in order (by stage i, or by the sink)
+    ordered = [max(1, int(stage[1])) == 1 and (len(stage) < 3 or max(1, int(stage[2])) == 1) for stage in stages] + [True]
+    windows = [_Window(queue_size) if o else None for o in ordered]
+
+    def gate(i):
+        """
+        Window that items put into queue i must be admitted by, or None. Only
+        queues from an in-order step into a multi-worker stage are gated, where
+        items still arrive in sequence order.
+        """
+        if ordered[i] or (i > 0 and not ordered[i - 1]):
+            return None
+        return windows[ordered.index(True, i)]
+
+    def fail(e):
+        errors.append(e)
+        stop.set()
+
+    def put(q, msg):
+        while not stop.is_set():
+            try:
+                q.put(msg, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(q):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def in_order(i):
+        """
+        Yields (seq, item) from queue i in sequence order, buffering early arrivals.
+        """
+        q, window = queues[i], windows[i]
+        pending = {}
+        next_seq = 0
+        while True:
+            msg = get(q)
+            if msg is _DONE:
+                return
+            pending[msg[0]] = msg[1]
+            while next_seq in pending:
+                yield next_seq, pending.pop(next_seq)
+                next_seq += 1
+                window.advance(next_seq)
+
+    def put_seq(i, seq, item, window):
+        if window is not None and not window.admit(seq, stop):
+            return False
+        return put(queues[i], (seq, item))
+
+    def produce():
+        window = gate(0)
+        try:
+            for seq, item in enumerate(source):
+                if not put_seq(0, seq, item, window):
+                    return
+            put(queues[0], _DONE)
+        except BaseException as e:
+            fail(e)
+
+    def take_batch(in_q, batch_size):
+        """
+        Blocks for one message, then adds whatever else is already queued.
+        Returns (messages, done).
+        """
+        msg = get(in_q)
+        if msg is _DONE:
+            return [], True
+        batch = [msg]
+        while len(batch) < batch_size:
+            try:
+                msg = in_q.get_nowait()
+            except queue.Empty:
+                break
+            if msg is _DONE:
+                return batch, True
+            batch.append(msg)
+        return batch, False
+
+    def work(fn, i, batch_size, remaining, lock):
+        in_q, out_q = queues[i], queues[i + 1]
+        try:
+            if ordered[i]:
+                window = gate(i + 1)
+                for seq, item in in_order(i):
+                    if not put_seq(i + 1, seq, fn(item), window):
+                        return
+            else:
+                while True:
+                    batch, done = take_batch(in_q, batch_size)
+                    if batch:
+                        items = [item for _, item in batch]
+                        results = fn(items) if batch_size > 1 else [fn(items[0])]
+                        for (seq, _), result in zip(batch, results):
+                            if not put(out_q, (seq, result)):
+                                return
+                    if done:
+                        # Hand the marker back so sibling workers see it too
+                        put(in_q, _DONE)
+                        break
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                put(out_q, _DONE)
+        except BaseException as e:
+            fail(e)
+
+    threads.append(threading.Thread(target=produce, name="pipeline-source", daemon=True))
+    for i, stage in enumerate(stages):
+        fn, workers = stage[0], max(1, int(stage[1]))
+        batch_size = max(1, int(stage[2])) if len(stage) > 2 else 1
+        remaining, lock = [workers], threading.Lock()
+        for w in range(workers):
+            threads.append(threading.Thread(
+                target=work,
+                args=(fn, i, batch_size, remaining, lock),
+                name=f"pipeline-stage{i}-{w}",
+                daemon=True,
+            ))
+
+    for t in threads:
+        t.start()
+    try:
+        for _, item in in_order(len(stages)):
+            sink(item)
+    except BaseException as e:
+        fail(e)
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+
+    if errors:
+        raise errors[0]
@@ -0,0 +1,253 @@
+import os
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+import onnxruntime
+from insightface.utils import face_align
+
+# Source latents kept across tasks, keyed by source image content hash
+LATENT_CACHE_SIZE = int(os.getenv("LATENT_CACHE_SIZE", "256"))
+
+# Aligned crops per swapper session call
+SWAP_BATCH_SIZE = int(os.getenv("SWAP_BATCH_SIZE", "8"))
+
+
+def make_dynamic_batch(model_path, output_path):
+    """
+    Copies an ONNX model with the batch dimension of its inputs/outputs made symbolic.
+    The published inswapper_128.onnx declares a fixed batch of 1.
+    """
+    import onnx
+    model = onnx.load(model_path)
+    initializers = {init.name for init in model.graph.initializer}
+    for value in list(model.graph.input) + list(model.graph.output):
+        if value.name in initializers:
+            continue
+        dim = value.type.tensor_type.shape.dim[0]
+        dim.ClearField("dim_value")
+        dim.dim_param = "batch"
+    onnx.save(model, output_path)
+
+
+class FaceSwapper:
+    """
+    INSwapper with the source latent computed once instead of on every call.
+
+    insightface's INSwapper.get projects the source embedding through `emap`
+    and renormalizes it for every target face of every frame, although the
+    source face never changes during a task.
+    """
+
+    def __init__(self, model, batch_size=SWAP_BATCH_SIZE, session_factory=None):
+        self.model = model
+        self.batch_size = max(1, batch_size)
+        self.session_factory = session_factory or (
+            lambda path: onnxruntime.InferenceSession(path, providers=model.session.get_providers())
+        )
+        self._latents = OrderedDict()
+        self._lock = threading.Lock()
+        self.batch_session = self._load_batch_session() if self.batch_size > 1 else None
+
+    def _load_batch_session(self):
+        """
+        Session that accepts more than one crop per call, or None to fall back to batch size 1.
+        A batch-enabled copy of a fixed-batch model is only used if it reproduces
+        the single-crop outputs, since some graphs hardcode the batch in reshapes.
+        """
+        session = self.model.session
+        if not isinstance(session.get_inputs()[0].shape[0], int):
+            return session
+
+        # The session may run a different file than model_file (e.g. the int8 swapper)
+        model_path = getattr(self.model, "session_file", self.model.model_file)
+        batch_path = os.path.splitext(model_path)[0] + ".dynbatch.onnx"
+        try:
+            if not os.path.exists(batch_path):
+                tmp_path = f"{batch_path}.{os.getpid()}.tmp"
+                make_dynamic_batch(model_path, tmp_path)
+                os.replace(tmp_path, batch_path)
+            batch_session = self.session_factory(batch_path)
+
+            rng = np.random.default_rng(0)
+            blob = rng.random((2, 3) + tuple(self.model.input_size[::-1]), dtype=np.float32)
+            latent = rng.standard_normal((2, self.model.emap.shape[1])).astype(np.float32)
+            latent /= np.linalg.norm(latent, axis=1, keepdims=True)
+            inputs = self.model.input_names
+            batched = batch_session.run(self.model.output_names, {inputs[0]: blob, inputs[1]: latent})[0]
+            single = np.concatenate([
+                session.run(self.model.output_names, {inputs[0]: blob[i:i + 1], inputs[1]: latent[i:i + 1]})[0]
+                for i in range(2)
+            ])
+            if np.allclose(batched, single, atol=1e-3):
+                print(f"Swapper batching enabled (batch size {self.batch_size})")
+                return batch_session
+            print("Swapper batching disabled: batched outputs differ from single-crop outputs")
+        except Exception as e:
+            print(f"Swapper batching disabled: {e}")
+        return None
+
+    def latent(self, source_face, key=None):
+        """
+        Swapper input for a source face. Pass the source content hash as `key`
+        to reuse the latent across tasks.
+        """
+        if key is not None:
+            with self._lock:
+                if key in self._latents:
+                    self._latents.move_to_end(key)
+                    return self._latents[key]
+
+        latent = source_face.normed_embedding.reshape((1, -1))
+        latent = np.dot(latent, self.model.emap)
+        latent /= np.linalg.norm(latent)
+        latent = latent.astype(np.float32)
+
+        if key is not None:
+            with self._lock:
+                self._latents[key] = latent
+                while len(self._latents) > LATENT_CACHE_SIZE:
+                    self._latents.popitem(last=False)
+        return latent
+
+    def run(self, blobs, latents):
+        """
+        Raw swapper inference: one latent row per blob, batch_size blobs per
+        session call when the model allows it. Returns the NCHW predictions.
+        """
+        model = self.model
+        if self.batch_session is not None:
+            session, step = self.batch_session, self.batch_size
+        else:
+            session, step = model.session, 1
+
+        preds = []
+        for start in range(0, len(blobs), step):
+            feed = {model.input_names[0]: blobs[start:start + step], model.input_names[1]: latents[start:start + step]}
+            preds.append(session.run(model.output_names, feed)[0])
+        return np.concatenate(preds)
+
+    def _infer(self, aimgs, latent):
+        """
+        Runs the swapper on aligned crops. Returns the swapped BGR crops.
+        """
+        model = self.model
+        blobs = cv2.dnn.blobFromImages(aimgs, 1.0 / model.input_std, model.input_size,
+                                       (model.input_mean, model.input_mean, model.input_mean), swapRB=True)
+        preds = self.run(blobs, np.repeat(latent, len(blobs), axis=0))
+        img_fake = preds.transpose((0, 2, 3, 1))
+        bgr_fake = np.clip(255 * img_fake, 0, 255).astype(np.uint8)[:, :, :, ::-1]
+        return list(bgr_fake)
+
+    def swap(self, img, target_face, latent, paste_back=True):
+        """
+        Same as INSwapper.get, but takes the precomputed latent and pastes into `img` in place.
+        """
+        aimg, M = face_align.norm_crop2(img, target_face.kps, self.model.input_size[0])
+        bgr_fake = self._infer([aimg], latent)[0]
+        if not paste_back:
+            return bgr_fake, M
+        return paste_back_face(img, bgr_fake, aimg, M)
+
+    def swap_frames(self, frames, latent):
+        """
+        Swaps every face of several frames with batched inference, in place.
+        `frames` is a list of (img, target_faces); returns the swapped images in order.
+        All crops are aligned from the unswapped frame, which only differs from
+        swapping one face at a time when faces overlap.
+        """
+        size = self.model.input_size[0]
+        crops = []
+        for i, (img, target_faces) in enumerate(frames):
+            for face in target_faces:
+                aimg, M = face_align.norm_crop2(img, face.kps, size)
+                crops.append((i, aimg, M))
+
+        results = [img for img, _ in frames]
+        if not crops:
+            return results
+        swapped = self._infer([aimg for _, aimg, _ in crops], latent)
+        for (i, aimg, M), bgr_fake in zip(crops, swapped):
+            results[i] = paste_back_face(results[i], bgr_fake, aimg, M)
+        return results
+
+
+_scratch = threading.local()
+_white = {}
+
+
+def _buffer(name, shape, dtype):
+    """
+    Per-thread reusable buffer: a C-contiguous view into a flat array that only
+    grows, so per-face scratch space is not reallocated on every frame.
+    """
+    size = int(np.prod(shape))
+    buf = getattr(_scratch, name, None)
+    if buf is None or buf.size < size:
+        buf = np.empty(size, dtype=dtype)
+        setattr(_scratch, name, buf)
+    return buf[:size].reshape(shape)
+
+
+def paste_back_face(target_img, bgr_fake, aimg, M):
+    """
+    Blends a swapped crop back into the frame, in place (INSwapper's paste-back).
+
+    Only the bounding box of the warped crop is touched: the blend mask is
+    eroded before it is blurred, so it is zero outside the warped square.
+    cv2.blendLinear rounds where INSwapper truncates and warps into a smaller
+    image, so pixels may differ from the full-frame blend by up to 2 levels
+    (checked by benchmarks/bench_paste_back.py). INSwapper also builds a
+    frame-sized `fake_diff` mask that it never uses; that is skipped.
+    """
+    height, width = target_img.shape[:2]
+    size = aimg.shape[0]
+    IM = cv2.invertAffineTransform(M)
+
+    corners = np.array([[0, 0], [size, 0], [0, size], [size, size]], dtype=np.float64)
+    pts = corners @ IM[:, :2].T + IM[:, 2]
+    # Bilinear warping spreads the square's edge over one crop pixel, i.e.
+    # 1 / scale frame pixels. The margin keeps a ring of zero mask around
+    # that inside the ROI, which erosion needs to behave as on the full frame.
+    scale = np.sqrt(abs(np.linalg.det(M[:, :2])))
+    margin = int(np.ceil(1 / scale)) + 2
+    x0 = max(int(np.floor(pts[:, 0].min())) - margin, 0)
+    y0 = max(int(np.floor(pts[:, 1].min())) - margin, 0)
+    x1 = min(int(np.ceil(pts[:, 0].max())) + margin, width)
+    y1 = min(int(np.ceil(pts[:, 1].max())) + margin, height)
+    if x1 <= x0 or y1 <= y0:
+        return target_img
+    roi_w, roi_h = x1 - x0, y1 - y0
+
+    # Same transform, expressed relative to the ROI origin
+    IM[0, 2] -= x0
+    IM[1, 2] -= y0
+
+    white = _white.get(size)
+    if white is None:
+        white = _white[size] = np.full((size, size), 255, dtype=np.float32)
+
+    warped = _buffer("warped", (roi_h, roi_w, 3), np.uint8)
+    img_mask = _buffer("mask", (roi_h, roi_w), np.float32)
+    inv_mask = _buffer("inv_mask", (roi_h, roi_w), np.float32)
+    cv2.warpAffine(bgr_fake, IM, (roi_w, roi_h), dst=warped, borderValue=0.0)
+    cv2.warpAffine(white, IM, (roi_w, roi_h), dst=img_mask, borderValue=0.0)
+
+    img_mask[img_mask > 20] = 255
+    mask_h_inds, mask_w_inds = np.where(img_mask == 255)
+    if len(mask_h_inds) == 0:
+        return target_img
+    mask_h = np.max(mask_h_inds) - np.min(mask_h_inds)
+    mask_w = np.max(mask_w_inds) - np.min(mask_w_inds)
+    mask_size = int(np.sqrt(mask_h * mask_w))
+    k = max(mask_size // 10, 10)
+    cv2.erode(img_mask, np.ones((k, k), np.uint8), dst=img_mask, iterations=1)
+    k = max(mask_size // 20, 5)
+    cv2.GaussianBlur(img_mask, (2 * k + 1, 2 * k + 1), 0, dst=img_mask)
+    img_mask *= 1.0 / 255
+    np.subtract(1.0, img_mask, out=inv_mask)
+
+    roi = target_img[y0:y1, x0:x1]
+    roi[...] = cv2.blendLinear(warped, np.ascontiguousarray(roi), img_mask, inv_mask)
+    return target_img
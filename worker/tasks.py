@@ -2,25 +2,36 @@ import sys
 import os
 # Add backend to sys.path to import crud/models
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 import crud
 import models
+import result_cache
+import source_faces
+import progress
 from database import SessionLocal
 from models import TaskStatus, TaskType
 
 import cv2
 import insightface
-from insightface.app import FaceAnalysis
-from insightface.model_zoo import get_model
 import numpy as np
-from celery import Celery
+from celery import Celery, chord
+from celery.signals import worker_process_init
 from dotenv import load_dotenv
 import tempfile
 import shutil
-import subprocess
+from concurrent.futures import ThreadPoolExecutor
 
 import onnxruntime
 
+import template_index
+import media_cache
+from tracking import FaceTracker
+from encoder import FFmpegWriter, probe_duration, probe_frame_count, split_video, concat_videos
+from pipeline import run_pipeline
+from model_registry import ModelRegistry
+from inference_server import RemoteRegistry
+
 load_dotenv()
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
@@ -38,20 +49,260 @@ else:
     print("⚠️ No GPU detected (or onnxruntime-gpu not installed). Running in CPU mode.")
     ctx_id = -1
 
-# Initialize InsightFace
-face_app = FaceAnalysis(name='buffalo_l', providers=providers)
-face_app.prepare(ctx_id=ctx_id, det_size=(640, 640))
-swapper = get_model('inswapper_128.onnx', download=True)
-# Ensure swapper uses the correct provider too (implicitly handled by onnxruntime usually, 
-# but passing providers if supported is better, though get_model interface is simple)
+# InsightFace models (detection, recognition, swapper) load lazily on first use,
+# so importing this module (worker boot, autoscaling) stays cheap
+DET_SIZE = (640, 640)
+
+# Socket of a host-wide inference server (worker/inference_server.py). When set, this
+# process loads no models and every prefork child shares the server's sessions.
+INFERENCE_SERVER = os.getenv("INFERENCE_SERVER")
+if INFERENCE_SERVER:
+    print(f"Using inference server at {INFERENCE_SERVER}")
+    registry = RemoteRegistry(INFERENCE_SERVER)
+else:
+    registry = ModelRegistry(providers, ctx_id, DET_SIZE)
+
+# Load the models as soon as each worker process starts instead of on its first task
+MODEL_PRELOAD = os.getenv("MODEL_PRELOAD", "0") == "1"
+
+@worker_process_init.connect
+def preload_models(**kwargs):
+    if MODEL_PRELOAD:
+        registry.load_all()
+
+# Processing 1080p or 4K on CPU is too slow, so video templates are downscaled to this height
+MAX_HEIGHT = 720
+
+# Keep the template's full resolution: detection (and tracking) still runs on a copy
+# downscaled to MAX_HEIGHT, but faces are swapped into and encoded at the original size.
+VIDEO_FULL_RES = os.getenv("VIDEO_FULL_RES", "0") == "1"
+
+# Templates without an index: run the detector every N frames and track keypoints in between.
+# 1 keeps full detection on every frame.
+VIDEO_DETECT_INTERVAL = int(os.getenv("VIDEO_DETECT_INTERVAL", "1"))
+
+# Threads per parallel stage of the video pipeline, and frames buffered between stages
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "2"))
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "8"))
+
+# Segmented mode: videos at least VIDEO_SEGMENT_MIN_SECONDS long are cut into
+# VIDEO_SEGMENTS chunks that are swapped by separate Celery subtasks. 1 disables it.
+VIDEO_SEGMENTS = int(os.getenv("VIDEO_SEGMENTS", "1"))
+VIDEO_SEGMENT_MIN_SECONDS = float(os.getenv("VIDEO_SEGMENT_MIN_SECONDS", "20"))
+# A segmented task still processing after this many seconds is failed (a chunk
+# whose worker died never reports back); each chunk is also killed after it
+VIDEO_SEGMENT_TIMEOUT = int(os.getenv("VIDEO_SEGMENT_TIMEOUT", "3600"))
+
+# Source images are analyzed at most at this size (longest side); only the
+# identity embedding is used, which does not need more
+SOURCE_ANALYSIS_MAX_SIDE = int(os.getenv("SOURCE_ANALYSIS_MAX_SIDE", "1024"))
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+
+def detect_faces(img):
+    """
+    Detection only (bbox + 5 keypoints). The swapper needs nothing else from
+    target faces, so this skips the recognition/landmark/genderage models.
+    """
+    bboxes, kpss = registry.detector.detect(img, max_num=0, metric='default')
+    faces = []
+    for i in range(bboxes.shape[0]):
+        faces.append(insightface.app.common.Face(
+            bbox=bboxes[i, 0:4],
+            kps=kpss[i] if kpss is not None else None,
+            det_score=bboxes[i, 4],
+        ))
+    return faces
+
+def scale_faces(faces, scale):
+    """
+    Faces with bbox and keypoints mapped to a frame `scale` times the size they were detected at.
+    """
+    if scale == 1:
+        return faces
+    return [
+        insightface.app.common.Face(bbox=face.bbox * scale, kps=face.kps * scale, det_score=face.det_score)
+        for face in faces
+    ]
+
+def processing_size(width, height):
+    if height > MAX_HEIGHT:
+        scale = MAX_HEIGHT / height
+        return int(width * scale), int(height * scale)
+    return width, height
+
+def resolve_media(url, temp_dir, stem):
+    """
+    Returns a local path for a media URL: downloads http(s) URLs into temp_dir,
+    resolves legacy "/static/..." paths relative to the backend.
+    """
+    import storage
+    path = storage.local_path(url)
+    if path is not None:
+        # Local storage backend on a shared volume: use the stored file directly
+        if not os.path.exists(path):
+            raise Exception(f"File not found: {url}")
+        return path
+
+    if url.startswith("http"):
+        # External or Supabase URL
+        ext = url.split("?")[0].split(".")[-1]
+        if len(ext) > 4: ext = "mp4"
+        path = os.path.join(temp_dir, f"{stem}.{ext}")
+        print(f"Downloading: {url}")
+        if not storage.download_file(url, path):
+            raise Exception(f"Failed to download {url}")
+        return path
+
+    # Legacy local path support (files from before the Supabase migration)
+    path = os.path.join(BACKEND_DIR, url.lstrip("/"))
+    if not os.path.exists(path):
+        raise Exception(f"File not found: {url}")
+    return path
+
+def resolve_template(url, temp_dir, stem):
+    """
+    Like resolve_media, but http(s) templates go through the worker's disk cache.
+    Returns (path, content hash).
+    """
+    import storage
+    if url.startswith("http") and media_cache.enabled() and storage.local_path(url) is None:
+        try:
+            return media_cache.fetch(url, temp_dir, stem)
+        except Exception as e:
+            print(f"Media cache failed for {url}, downloading directly: {e}")
+    path = resolve_media(url, temp_dir, stem)
+    return path, template_index.file_sha256(path)
+
+def build_template_index(template_path, is_video):
+    """
+    Runs detection over every frame of a template once, at the same
+    processing resolution the swap uses.
+    """
+    builder = template_index.TemplateIndexBuilder()
+    if not is_video:
+        img = cv2.imread(template_path)
+        if img is None:
+            print(f"Error: Could not read template image {template_path}")
+            return None
+        builder.add(detect_faces(img))
+        return builder.build(img.shape[1], img.shape[0], 0, DET_SIZE)
+
+    cap = cv2.VideoCapture(template_path)
+    if not cap.isOpened():
+        print(f"Error: Could not open template video {template_path}")
+        return None
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    original_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    original_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    width, height = processing_size(original_width, original_height)
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        if height != original_height:
+            frame = cv2.resize(frame, (width, height))
+        builder.add(detect_faces(frame))
+    cap.release()
+    return builder.build(width, height, fps, DET_SIZE)
+
+class NoSourceFaceError(Exception):
+    pass
+
+def set_task_status(db, task_id, status, result_url=None, error_message=None):
+    """
+    Updates the task row and tells clients watching the task's event stream.
+    """
+    crud.update_task_status(db, task_id, status, result_url=result_url, error_message=error_message)
+    progress.publish(task_id, status.value, result_url=result_url, error_message=error_message)
+
+def get_template_index(content_hash):
+    try:
+        return template_index.load_index(content_hash, DET_SIZE)
+    except Exception as e:
+        print(f"Template index lookup failed: {e}")
+        return None
+
+def store_template_index(content_hash, index):
+    try:
+        template_index.save_index(content_hash, index)
+    except Exception as e:
+        print(f"Failed to save template index: {e}")
+
+@celery_app.task(name="analyze_template_task")
+def analyze_template_task(template_id: int):
+    """
+    Precomputes the per-frame face index of a template so swaps can skip detection.
+    """
+    print(f"Analyzing template {template_id}")
+    db = SessionLocal()
+    temp_dir = tempfile.mkdtemp()
+    try:
+        template = crud.get_template(db, template_id)
+        if not template:
+            print(f"Template {template_id} not found")
+            return
+
+        template_path, content_hash = resolve_template(template.source_url or template.thumbnail, temp_dir, f"template_{template_id}")
+        if get_template_index(content_hash) is not None:
+            print(f"Template {template_id} already indexed ({content_hash[:12]})")
+            return
+
+        index = build_template_index(template_path, template.type == TaskType.VIDEO)
+        if index is not None:
+            store_template_index(content_hash, index)
+            print(f"Indexed template {template_id}: {index.n_frames} frames, {len(index.scores)} faces")
+    except Exception as e:
+        print(f"Error analyzing template {template_id}: {e}")
+    finally:
+        db.close()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+@celery_app.task(name="preprocess_upload_task")
+def preprocess_upload_task(upload_id: int):
+    """
+    Runs as soon as a source image is uploaded: records its content hash for
+    the result cache, stores a normalized, downsized copy and analyzes the
+    face, so the swap task starts with the embedding ready and a missing face
+    is reported before any gems are spent.
+    """
+    import storage
+    db = SessionLocal()
+    temp_dir = tempfile.mkdtemp()
+    try:
+        upload = crud.get_upload(db, upload_id)
+        if not upload:
+            print(f"Upload {upload_id} not found")
+            return
+
+        path = resolve_media(upload.url, temp_dir, f"upload_{upload_id}")
+        content_hash = template_index.file_sha256(path)
+        result_cache.record_content_hash(upload.url, content_hash)
+
+        # Swap tasks fall back to this small copy instead of the original if
+        # the analysis below has expired from Redis by then
+        normalized_path = normalize_source_image(path, os.path.join(temp_dir, "normalized.jpg"))
+        if normalized_path is not None:
+            storage.upload_file(normalized_path, "faceswap", normalized_source_path(content_hash))
+            path = normalized_path
+
+        face = source_face_for(path, content_hash)
+        face_status = models.FaceStatus.FOUND if face is not None else models.FaceStatus.NOT_FOUND
+        crud.update_upload(db, upload_id, content_hash=content_hash, face_status=face_status)
+        print(f"Upload {upload_id}: face {face_status.value}")
+    except Exception as e:
+        print(f"Error preprocessing upload {upload_id}: {e}")
+    finally:
+        db.close()
+        shutil.rmtree(temp_dir, ignore_errors=True)
 
 @celery_app.task(name="process_swap_task")
 def process_swap_task(task_id: int):
     print(f"Processing task {task_id}")
     db = SessionLocal()
+    temp_dir = None
     import storage # Import local storage module in worker context (sys.path modified above)
-    import requests
-    
+
     try:
         task = crud.get_swap_task(db, task_id)
         if not task:
@@ -59,50 +310,32 @@ def process_swap_task(task_id: int):
             return
             
         # Update status to PROCESSING
-        crud.update_task_status(db, task_id, TaskStatus.PROCESSING)
+        set_task_status(db, task_id, TaskStatus.PROCESSING)
         
         # Temp Workspace
         temp_dir = tempfile.mkdtemp()
-        source_filename = f"source_{task_id}.{'mp4' if task.type == TaskType.VIDEO else 'jpg'}" 
-        
-        source_path = os.path.join(temp_dir, source_filename)
-        
-        # Download Source
-        print(f"Downloading source: {task.source_url}")
-        if task.source_url.startswith("http"):
-             if not storage.download_file(task.source_url, source_path):
-                 raise Exception("Failed to download source file")
-        else:
-             # Fallback for old local files (if any exist during migration)
-             # task.source_url might be relative "/static/..."
-             # We need to find where that is relative to backend
-             worker_dir = os.path.dirname(os.path.abspath(__file__))
-             backend_dir = os.path.join(worker_dir, "..", "backend")
-             local_source = os.path.join(backend_dir, task.source_url.lstrip("/"))
-             if os.path.exists(local_source):
-                  shutil.copy(local_source, source_path)
-             else:
-                  raise Exception(f"Source file not found: {task.source_url}")
-
-        # Download Template
-        template_filename = f"template_{task_id}.jpg" 
-        
-        if task.template_url.startswith("http"):
-            # External or Supabase URL
-            ext = task.template_url.split("?")[0].split(".")[-1]
-            if len(ext) > 4: ext = "mp4" 
-            template_filename = f"template_{task_id}.{ext}"
-            template_path = os.path.join(temp_dir, template_filename)
-            print(f"Downloading template: {task.template_url}")
-            if not storage.download_file(task.template_url, template_path):
-                 raise Exception("Failed to download template file")
-        else:
-             # Legacy local path support
-             worker_dir = os.path.dirname(os.path.abspath(__file__))
-             backend_dir = os.path.join(worker_dir, "..", "backend")
-             template_path = os.path.join(backend_dir, task.template_url.lstrip("/"))
-             if not os.path.exists(template_path):
-                 raise Exception(f"Template file not found: {template_path}")
+
+        # The content hash recorded when the source was uploaded, if it was
+        upload = crud.get_user_upload_by_url(db, task.user_id, task.source_url)
+        upload_hash = upload.content_hash if upload is not None else None
+
+        # Resolve Source & Template concurrently
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            source_future = pool.submit(resolve_source, task.source_url, upload_hash, temp_dir, f"source_{task_id}")
+            template_future = pool.submit(resolve_template, task.template_url, temp_dir, f"template_{task_id}")
+            source_face, source_hash = source_future.result()
+            template_path, template_hash = template_future.result()
+        result_cache.record_content_hash(task.source_url, source_hash)
+        result_cache.record_content_hash(task.template_url, template_hash)
+        if source_face is None:
+            raise NoSourceFaceError("No face detected in source image")
+
+        # Same source and template content as an earlier swap: reuse its result
+        cached_url = result_cache.lookup(source_hash, template_hash)
+        if cached_url:
+            print(f"Result cache hit for task {task_id}")
+            set_task_status(db, task_id, TaskStatus.COMPLETED, result_url=cached_url)
+            return
 
         # Result Path
         result_filename = f"result_{task_id}.{'mp4' if task.type == TaskType.VIDEO else 'jpg'}"
@@ -110,25 +343,32 @@ def process_swap_task(task_id: int):
         
         success = False
         if task.type == TaskType.VIDEO:
-             success = process_video_swap(source_path, template_path, result_path)
+             if VIDEO_SEGMENTS > 1 and dispatch_video_segments(task_id, source_face, source_hash, template_path, temp_dir, template_hash):
+                 # finalize_video_segments completes the task once all segments are done
+                 return
+             success = process_video_swap(source_face, template_path, result_path, template_hash, source_hash, task_id)
         else:
             # IMAGE SWAP
-            source_img = cv2.imread(source_path)
             target_img = cv2.imread(template_path)
             
-            if source_img is None or target_img is None:
+            if target_img is None:
                  raise Exception("Could not read images")
 
-            source_faces = face_app.get(source_img)
-            target_faces = face_app.get(target_img)
+            index = get_template_index(template_hash)
+            if index is not None:
+                target_faces = index.faces(0, scale=target_img.shape[1] / index.width)
+            else:
+                target_faces = detect_faces(target_img)
+                builder = template_index.TemplateIndexBuilder()
+                builder.add(target_faces)
+                store_template_index(template_hash, builder.build(target_img.shape[1], target_img.shape[0], 0, DET_SIZE))
 
-            if not source_faces or not target_faces:
+            if not target_faces:
                 raise Exception("No face detected")
             
-            res = target_img.copy()
-            source_face = source_faces[0]
-            for face in target_faces:
-                res = swapper.get(res, face, source_face, paste_back=True)
+            face_swapper = registry.face_swapper
+            latent = face_swapper.latent(source_face, key=source_hash)
+            res = face_swapper.swap_frames([(target_img, target_faces)], latent)[0]
             
             cv2.imwrite(result_path, res)
             success = True
@@ -138,34 +378,277 @@ def process_swap_task(task_id: int):
             print("Uploading result...")
             public_url = storage.upload_file(result_path, "faceswap", f"results/{result_filename}")
             if public_url:
-                crud.update_task_status(db, task_id, TaskStatus.COMPLETED, result_url=public_url)
+                set_task_status(db, task_id, TaskStatus.COMPLETED, result_url=public_url)
+                result_cache.store(source_hash, template_hash, public_url)
             else:
                  raise Exception("Failed to upload result")
         else:
-            crud.update_task_status(db, task_id, TaskStatus.FAILED, error_message="Processing failed")
+            set_task_status(db, task_id, TaskStatus.FAILED, error_message="Processing failed")
 
     except Exception as e:
         print(f"Error processing task {task_id}: {e}")
         import traceback
         traceback.print_exc()
-        crud.update_task_status(db, task_id, TaskStatus.FAILED, error_message=str(e))
+        set_task_status(db, task_id, TaskStatus.FAILED, error_message=str(e))
+        if isinstance(e, NoSourceFaceError):
+            # Submitted before the upload's analysis finished, which would have rejected it for free
+            crud.update_user_gems(db, task.user_id, task.cost)
+            print(f"Refunded {task.cost} gems for task {task_id}")
     finally:
         db.close()
-        if os.path.exists(temp_dir):
+        if temp_dir and os.path.exists(temp_dir):
             shutil.rmtree(temp_dir)
 
-def process_video_swap(source_path, template_path, output_path):
-    # 1. Open Source Image & Detect Face
+def dispatch_video_segments(task_id, source_face, source_hash, template_path, temp_dir, template_hash=None):
+    """
+    Cuts the template at keyframes and fans the chunks out as a chord of
+    process_video_segment subtasks sharing the source embedding.
+    Returns False if the video is too short to be worth splitting.
+    """
+    import storage
+
+    duration = probe_duration(template_path)
+    if duration < VIDEO_SEGMENT_MIN_SECONDS:
+        return False
+
+    segment_dir = os.path.join(temp_dir, "segments")
+    os.makedirs(segment_dir)
+    segments = split_video(template_path, segment_dir, duration / VIDEO_SEGMENTS)
+    if len(segments) < 2:
+        return False
+
+    segment_urls = []
+    # First frame of each chunk in the template, so the chunks can use its index
+    start_frames = []
+    start_frame = 0
+    for i, segment_path in enumerate(segments):
+        url = storage.upload_file(segment_path, "faceswap", f"segments/{task_id}/template_{i:03d}.mp4")
+        if not url:
+            raise Exception("Failed to upload template segment")
+        segment_urls.append(url)
+        start_frames.append(start_frame)
+        start_frame += probe_frame_count(segment_path)
+
+    embedding = source_face.embedding.astype(float).tolist()
+    segment_count = len(segment_urls)
+    print(f"Dispatching {segment_count} segments for task {task_id}")
+    on_failure = fail_video_segments.s(task_id=task_id, segment_count=segment_count)
+    chord(
+        process_video_segment.s(task_id, i, url, embedding, source_hash, segment_count, template_hash, start_frames[i])
+        for i, url in enumerate(segment_urls)
+    )(finalize_video_segments.s(task_id, source_hash, template_hash).on_error(on_failure))
+    # If a chunk's worker dies the chord never fires, callback or error callback
+    on_failure.apply_async(countdown=VIDEO_SEGMENT_TIMEOUT)
+    return True
+
+@celery_app.task(name="process_video_segment", time_limit=VIDEO_SEGMENT_TIMEOUT)
+def process_video_segment(task_id: int, segment_index: int, segment_url: str, embedding: list, source_hash: str = None,
+                          segment_count: int = 1, template_hash: str = None, start_frame: int = 0):
+    """
+    Swaps one chunk of a segmented video, starting at `start_frame` of the
+    template with hash `template_hash`. Returns the uploaded chunk URL, or None on failure.
+    """
+    import storage
+    temp_dir = tempfile.mkdtemp()
+    try:
+        segment_path = resolve_media(segment_url, temp_dir, f"segment_{segment_index:03d}")
+        output_path = os.path.join(temp_dir, f"result_{segment_index:03d}.mp4")
+        source_face = insightface.app.common.Face(embedding=np.array(embedding, dtype=np.float32))
+        reporter = progress.ProgressReporter(task_id, part=segment_index, parts=segment_count)
+        if not swap_video(source_face, segment_path, output_path, template_hash, source_hash, reporter, start_frame=start_frame):
+            return None
+        return storage.upload_file(output_path, "faceswap", f"segments/{task_id}/result_{segment_index:03d}.mp4")
+    except Exception as e:
+        print(f"Error processing segment {segment_index} of task {task_id}: {e}")
+        return None
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+@celery_app.task(name="finalize_video_segments")
+def finalize_video_segments(segment_urls: list, task_id: int, source_hash: str = None, template_hash: str = None):
+    """
+    Chord callback: concatenates the swapped chunks losslessly and completes the task.
+    """
+    db = SessionLocal()
+    temp_dir = tempfile.mkdtemp()
+    try:
+        task = crud.get_swap_task(db, task_id)
+        if task is None or task.status != TaskStatus.PROCESSING:
+            # Already failed by the watchdog
+            print(f"Task {task_id} is no longer processing, dropping its segments")
+            return
+        if not segment_urls or any(url is None for url in segment_urls):
+            raise Exception("Processing failed")
+
+        paths = [
+            resolve_media(url, temp_dir, f"result_{i:03d}")
+            for i, url in enumerate(segment_urls)
+        ]
+        result_filename = f"result_{task_id}.mp4"
+        result_path = os.path.join(temp_dir, result_filename)
+        concat_videos(paths, result_path)
+
+        print("Uploading result...")
+        import storage
+        public_url = storage.upload_file(result_path, "faceswap", f"results/{result_filename}")
+        if not public_url:
+            raise Exception("Failed to upload result")
+        set_task_status(db, task_id, TaskStatus.COMPLETED, result_url=public_url)
+        result_cache.store(source_hash, template_hash, public_url)
+    except Exception as e:
+        print(f"Error finalizing task {task_id}: {e}")
+        set_task_status(db, task_id, TaskStatus.FAILED, error_message=str(e))
+    finally:
+        # The chunks are only needed until the result is assembled
+        delete_video_segments(task_id, len(segment_urls or []))
+        db.close()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+@celery_app.task(name="fail_video_segments")
+def fail_video_segments(request=None, exc=None, traceback=None, task_id: int = None, segment_count: int = 0):
+    """
+    Error callback of the segment chord (called with the failed request), and
+    the watchdog scheduled VIDEO_SEGMENT_TIMEOUT after dispatch. Fails the task
+    if it is still processing and deletes its chunks.
+    """
+    db = SessionLocal()
+    try:
+        task = crud.get_swap_task(db, task_id)
+        if task is None or task.status != TaskStatus.PROCESSING:
+            return
+        error_message = f"Segment failed: {exc}" if exc is not None else "Video processing timed out"
+        print(f"Task {task_id}: {error_message}")
+        set_task_status(db, task_id, TaskStatus.FAILED, error_message=error_message)
+        delete_video_segments(task_id, segment_count)
+    finally:
+        db.close()
+
+def delete_video_segments(task_id, segment_count):
+    import storage
+    chunks = [f"segments/{task_id}/{kind}_{i:03d}.mp4" for kind in ("template", "result") for i in range(segment_count)]
+    storage.delete_files("faceswap", chunks)
+
+def analyze_source_face(img):
+    """
+    First detected face with its identity embedding, or None.
+    """
+    faces = detect_faces(img)
+    if not faces:
+        return None
+    face = faces[0]
+    registry.recognizer.get(img, face)
+    return face
+
+def get_source_face(source_path):
     source_img = cv2.imread(source_path)
     if source_img is None:
         print(f"Error: Could not read source image {source_path}")
-        return False
+        return None
 
-    source_faces = face_app.get(source_img)
-    if not source_faces:
+    # Detection runs at DET_SIZE anyway; a smaller copy is faster to decode into the detector
+    scale = min(1.0, SOURCE_ANALYSIS_MAX_SIDE / max(source_img.shape[:2]))
+    if scale < 1.0:
+        source_img = cv2.resize(source_img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    source_face = analyze_source_face(source_img)
+    if source_face is None:
         print("Error: No face detected in source image")
-        return False
-    source_face = source_faces[0]
+        return None
+    # Keypoints / bbox in the coordinates of the original image
+    return insightface.app.common.Face(
+        bbox=source_face.bbox / scale, kps=source_face.kps / scale,
+        det_score=source_face.det_score, embedding=source_face.embedding,
+    )
+
+def normalized_source_path(content_hash):
+    return f"sources/{content_hash}.jpg"
+
+def normalize_source_image(path, output_path):
+    """
+    Writes the source image as a JPEG at most SOURCE_ANALYSIS_MAX_SIDE pixels
+    on its longest side (EXIF orientation applied). Returns output_path, or
+    None if the image cannot be read.
+    """
+    img = cv2.imread(path)
+    if img is None:
+        return None
+    scale = min(1.0, SOURCE_ANALYSIS_MAX_SIDE / max(img.shape[:2]))
+    if scale < 1.0:
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    cv2.imwrite(output_path, img, [cv2.IMWRITE_JPEG_QUALITY, 95])
+    return output_path
+
+def load_source_face(source_hash):
+    """
+    The face stored by the analysis at upload time, or None.
+    """
+    cached = source_faces.load(source_hash)
+    if cached is None:
+        return None
+    print(f"Using pre-analyzed source face ({source_hash[:12]})")
+    return insightface.app.common.Face(
+        embedding=np.array(cached["embedding"], dtype=np.float32),
+        kps=np.array(cached["kps"], dtype=np.float32),
+        bbox=np.array(cached["bbox"], dtype=np.float32),
+        det_score=cached["det_score"],
+    )
+
+def resolve_source(url, content_hash, temp_dir, stem):
+    """
+    (source face or None, content hash) of a swap's source image. With the
+    content hash recorded at upload time, the stored analysis is used, else
+    the normalized copy; the original is only downloaded (and hashed) for
+    sources that were never preprocessed.
+    """
+    source_face = load_source_face(content_hash)
+    if source_face is not None:
+        return source_face, content_hash
+
+    path = None
+    if content_hash:
+        import storage
+        try:
+            path = resolve_media(storage.public_url("faceswap", normalized_source_path(content_hash)), temp_dir, f"{stem}_normalized")
+        except Exception as e:
+            print(f"No normalized copy of the source: {e}")
+    if path is None:
+        path = resolve_media(url, temp_dir, stem)
+        content_hash = content_hash or template_index.file_sha256(path)
+    return source_face_for(path, content_hash), content_hash
+
+def source_face_for(source_path, source_hash=None):
+    """
+    The source face, from the analysis done at upload time if there is one
+    (keyed by content hash). Otherwise it is analyzed now and stored for next time.
+    """
+    cached = load_source_face(source_hash)
+    if cached is not None:
+        return cached
+
+    source_face = get_source_face(source_path)
+    if source_face is not None and source_hash:
+        source_faces.store(source_hash, {
+            "embedding": source_face.embedding.astype(float).tolist(),
+            "kps": np.asarray(source_face.kps, dtype=float).tolist(),
+            "bbox": np.asarray(source_face.bbox, dtype=float).tolist(),
+            "det_score": float(source_face.det_score),
+        })
+    return source_face
+
+def process_video_swap(source_face, template_path, output_path, template_hash=None, source_hash=None, task_id=None):
+    reporter = progress.ProgressReporter(task_id) if task_id is not None else None
+    return swap_video(source_face, template_path, output_path, template_hash, source_hash, reporter)
+
+def swap_video(source_face, template_path, output_path, template_hash=None, source_hash=None, reporter=None, start_frame=None):
+    """
+    Swaps every frame of template_path. template_hash names the template's
+    index; start_frame is set when template_path is a chunk of that template
+    starting at that frame.
+    """
+    # The swapper input only depends on the source face, so compute it once per task
+    # (or reuse it from an earlier task with the same source image)
+    face_swapper = registry.face_swapper
+    latent = face_swapper.latent(source_face, key=source_hash)
 
     # 2. Open Video Capture (Template)
     cap = cv2.VideoCapture(template_path)
@@ -179,99 +662,116 @@ def process_video_swap(source_path, template_path, output_path):
     original_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
     total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
 
-    # Optimization: Resize if too large (e.g. > 720p)
-    # Processing 1080p or 4K on CPU is too slow.
-    MAX_HEIGHT = 720
-    if original_height > MAX_HEIGHT:
-        scale = MAX_HEIGHT / original_height
-        width = int(original_width * scale)
-        height = int(original_height * scale)
-        print(f"Downscaling video from {original_width}x{original_height} to {width}x{height} for speed.")
+    # Optimization: detect at most at 720p. Unless VIDEO_FULL_RES is set, the
+    # swap and the output are downscaled too.
+    det_width, det_height = processing_size(original_width, original_height)
+    if VIDEO_FULL_RES:
+        width, height = original_width, original_height
+        if det_height != original_height:
+            print(f"Detecting at {det_width}x{det_height}, swapping at {width}x{height}.")
     else:
-        width = original_width
-        height = original_height
+        width, height = det_width, det_height
+        if height != original_height:
+            print(f"Downscaling video from {original_width}x{original_height} to {width}x{height} for speed.")
+    # Detections are made at det_width x det_height and mapped to the swap resolution
+    det_scale = width / det_width
 
-    # 3. Prepare Video Writer (Temp output without audio)
-    temp_dir = tempfile.mkdtemp()
-    temp_video_path = os.path.join(temp_dir, "temp_video_swap.mp4")
-    
-    # Use mp4v for compatibility
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v') 
-    out = cv2.VideoWriter(temp_video_path, fourcc, fps, (width, height))
+    # Precomputed detections for this template, if it was analyzed before.
+    # Otherwise record the detections of this run so the next task can skip them.
+    index = get_template_index(template_hash) if template_hash else None
+    if index is not None and start_frame is not None:
+        index = index.slice(start_frame, total_frames) if start_frame < index.n_frames else None
+    index_builder = None
+    tracker = None
+    if index is not None:
+        print(f"Using template index ({index.n_frames} frames)")
+        index_scale = det_width / index.width
+    elif VIDEO_DETECT_INTERVAL > 1:
+        # Tracked keypoints are approximate, so they are never recorded as an index
+        tracker = FaceTracker(detect_faces, interval=VIDEO_DETECT_INTERVAL)
+    elif template_hash and start_frame is None:
+        # A chunk only covers part of the template, so its detections are not recorded
+        index_builder = template_index.TemplateIndexBuilder()
+
+    # 3. Start the encoder: frames are piped straight into ffmpeg, which also muxes
+    # the audio of the ORIGINAL template_path, so there is no intermediate file
+    out = FFmpegWriter(output_path, width, height, fps, audio_source=template_path)
 
     print(f"Processing video: {width}x{height} @ {fps}fps, {total_frames} frames")
 
     # 4. Process Frames
+    # Decode, detection, swap and encode overlap in separate threads (ONNX Runtime
+    # and OpenCV release the GIL); the encoder receives frames in order.
     frame_count = 0
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        
-        # Resize frame if needed
-        if height != original_height:
-             frame = cv2.resize(frame, (width, height))
-        
+
+    def decode():
+        frame_idx = 0
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            # Resize frame if needed
+            if height != original_height:
+                frame = cv2.resize(frame, (width, height))
+            yield frame_idx, frame
+            frame_idx += 1
+
+    def detect(item):
+        # Detect faces in target frame (or look them up in the index)
+        frame_idx, frame = item
+        if index is not None and frame_idx < index.n_frames:
+            det_faces = index.faces(frame_idx, scale=index_scale)
+        else:
+            det_frame = frame if det_scale == 1 else cv2.resize(frame, (det_width, det_height))
+            if tracker is not None:
+                det_faces = tracker.update(det_frame)
+            else:
+                det_faces = detect_faces(det_frame)
+        return frame, scale_faces(det_faces, det_scale), det_faces
+
+    def swap(items):
+        # Crops of all faces in the batch of frames go through the swapper together.
+        # Decoded frames belong to the pipeline, so they are swapped in place.
+        results = face_swapper.swap_frames([(frame, target_faces) for frame, target_faces, _ in items], latent)
+        return [(res, det_faces) for res, (_, _, det_faces) in zip(results, items)]
+
+    def write(item):
+        nonlocal frame_count
+        res, det_faces = item
         frame_count += 1
         if frame_count % 10 == 0:
             print(f"Processing frame {frame_count}/{total_frames} ({(frame_count/total_frames)*100:.1f}%)")
-
-        # Detect faces in target frame
-        target_faces = face_app.get(frame)
-        
-        # Swap faces
-        res = frame.copy()
-        for face in target_faces:
-            res = swapper.get(res, face, source_face, paste_back=True)
-        
-        # Write frame
+        if reporter is not None:
+            reporter.update(frame_count, total_frames)
+        if index_builder is not None:
+            index_builder.add(det_faces)
         out.write(res)
 
-    # Release resources
-    cap.release()
-    out.release()
-
-    # 5. Merge Audio with FFmpeg
-    # We use the temp video we just created and the audio from the ORIGINAL template_path
-    print("Merging audio...")
     try:
-        # Check if source has audio
-        probe = subprocess.run(
-            ['ffprobe', '-v', 'error', '-show_entries', 'stream=codec_type', '-of', 'default=noprint_wrappers=1:nokey=1', template_path],
-            capture_output=True, text=True
+        run_pipeline(
+            decode(),
+            [
+                # The tracker is stateful, so it needs frames one at a time and in order
+                (detect, 1 if tracker is not None else PIPELINE_WORKERS),
+                (swap, PIPELINE_WORKERS, face_swapper.batch_size),
+            ],
+            write,
+            queue_size=PIPELINE_QUEUE_SIZE,
         )
-        has_audio = 'audio' in probe.stdout
+    except Exception:
+        out.abort()
+        raise
+    finally:
+        cap.release()
 
-        ffmpeg_cmd = [
-            'ffmpeg', '-y', # Overwrite output
-            '-i', temp_video_path,
-        ]
+    # 5. Finish encoding
+    success = out.close()
+    if not success:
+        print("FFmpeg error: encoder exited with an error")
 
-        if has_audio:
-            ffmpeg_cmd.extend(['-i', template_path])
-            # Map video from 0, audio from 1
-            ffmpeg_cmd.extend(['-map', '0:v:0', '-map', '1:a:0'])
-        else:
-            # Just use the video stream
-            ffmpeg_cmd.extend(['-map', '0:v:0'])
-        
-        # Re-encode to H.264 for web compatibility
-        ffmpeg_cmd.extend([
-            '-c:v', 'libx264', 
-            '-pix_fmt', 'yuv420p', # Ensure compatibility
-            '-c:a', 'aac', # Re-encode audio to aac if present
-            '-shortest', # Stop when the shortest stream ends
-            output_path
-        ])
-
-        subprocess.run(ffmpeg_cmd, check=True)
-        success = True
-    except subprocess.CalledProcessError as e:
-        print(f"FFmpeg error: {e}")
-        success = False
-    finally:
-        # Cleanup
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
+    if tracker is not None:
+        print(f"Tracking: {tracker.detections} detections, {tracker.tracked} tracked frames")
+    if index_builder is not None and frame_count > 0:
+        store_template_index(template_hash, index_builder.build(det_width, det_height, fps, DET_SIZE))
 
     return success
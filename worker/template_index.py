@@ -0,0 +1,190 @@
+import os
+import time
+import hashlib
+import tempfile
+import threading
+
+import numpy as np
+from insightface.app.common import Face
+
+# Bump whenever the detector, the processing resolution rules or the file
+# layout change so stale sidecars are ignored instead of misused.
+INDEX_VERSION = 1
+INDEX_DIR = os.getenv(
+    "TEMPLATE_INDEX_DIR",
+    os.path.join(tempfile.gettempdir(), "faceswap_template_index"),
+)
+INDEX_BUCKET = "faceswap"
+INDEX_PREFIX = "template_index"
+# Templates found to have no index in storage are not looked up again for this long
+INDEX_MISS_TTL = float(os.getenv("TEMPLATE_INDEX_MISS_TTL", "60"))
+
+# content hash -> time.monotonic() until which it is known to have no index
+_misses = {}
+_misses_lock = threading.Lock()
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """
+    Content hash used to key the index (and anything else derived from a template).
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def index_name(content_hash: str) -> str:
+    return f"{content_hash}.v{INDEX_VERSION}.npz"
+
+
+class TemplateIndex:
+    """
+    Per-frame detections of a template, stored as flat arrays.
+
+    Faces of frame i are rows frame_offsets[i]:frame_offsets[i + 1] of
+    bboxes / kps / scores. width / height is the resolution detection ran at.
+    """
+
+    def __init__(self, width, height, fps, det_size, frame_offsets, bboxes, kps, scores):
+        self.width = int(width)
+        self.height = int(height)
+        self.fps = float(fps)
+        self.det_size = tuple(int(v) for v in det_size)
+        self.frame_offsets = np.asarray(frame_offsets, dtype=np.int32)
+        self.bboxes = np.asarray(bboxes, dtype=np.float32).reshape(-1, 4)
+        self.kps = np.asarray(kps, dtype=np.float32).reshape(-1, 5, 2)
+        self.scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+
+    @property
+    def n_frames(self) -> int:
+        return len(self.frame_offsets) - 1
+
+    def faces(self, frame_idx: int, scale: float = 1.0):
+        start, end = self.frame_offsets[frame_idx], self.frame_offsets[frame_idx + 1]
+        return [
+            Face(bbox=self.bboxes[i] * scale, kps=self.kps[i] * scale, det_score=self.scores[i])
+            for i in range(start, end)
+        ]
+
+    def slice(self, start: int, count: int):
+        """
+        Index of frames start..start + count (e.g. one chunk of a segmented video).
+        """
+        offsets = self.frame_offsets[start:start + count + 1]
+        rows = slice(offsets[0], offsets[-1])
+        return TemplateIndex(
+            self.width, self.height, self.fps, self.det_size, offsets - offsets[0],
+            self.bboxes[rows], self.kps[rows], self.scores[rows],
+        )
+
+    def save(self, path: str):
+        # Write to a temp file and rename so concurrent readers never see a partial sidecar
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".npz")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(
+                    f,
+                    version=np.int32(INDEX_VERSION),
+                    resolution=np.array([self.width, self.height], dtype=np.int32),
+                    fps=np.float32(self.fps),
+                    det_size=np.array(self.det_size, dtype=np.int32),
+                    frame_offsets=self.frame_offsets,
+                    bboxes=self.bboxes,
+                    kps=self.kps,
+                    scores=self.scores,
+                )
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @classmethod
+    def load(cls, path: str):
+        with np.load(path) as data:
+            if int(data["version"]) != INDEX_VERSION:
+                return None
+            width, height = data["resolution"]
+            return cls(
+                width, height, data["fps"], data["det_size"],
+                data["frame_offsets"], data["bboxes"], data["kps"], data["scores"],
+            )
+
+
+class TemplateIndexBuilder:
+    """
+    Accumulates detections frame by frame, e.g. while a swap runs full detection anyway.
+    """
+
+    def __init__(self):
+        self.frame_offsets = [0]
+        self.bboxes = []
+        self.kps = []
+        self.scores = []
+
+    def add(self, faces):
+        for face in faces:
+            self.bboxes.append(np.asarray(face.bbox, dtype=np.float32)[:4])
+            self.kps.append(np.asarray(face.kps, dtype=np.float32))
+            self.scores.append(float(face.det_score))
+        self.frame_offsets.append(len(self.bboxes))
+
+    def build(self, width, height, fps, det_size) -> TemplateIndex:
+        return TemplateIndex(
+            width, height, fps, det_size, self.frame_offsets,
+            np.array(self.bboxes, dtype=np.float32).reshape(-1, 4),
+            np.array(self.kps, dtype=np.float32).reshape(-1, 5, 2),
+            np.array(self.scores, dtype=np.float32),
+        )
+
+
+def load_index(content_hash: str, det_size):
+    """
+    Returns the TemplateIndex for a template hash, or None.
+    Looks in the local index dir first, then in the shared storage bucket.
+    """
+    path = os.path.join(INDEX_DIR, index_name(content_hash))
+    if not os.path.exists(path):
+        import storage
+        with _misses_lock:
+            if time.monotonic() < _misses.get(content_hash, 0):
+                return None
+        os.makedirs(INDEX_DIR, exist_ok=True)
+        url = storage.public_url(INDEX_BUCKET, f"{INDEX_PREFIX}/{index_name(content_hash)}")
+        if not url:
+            return None
+        fd, tmp_path = tempfile.mkstemp(dir=INDEX_DIR, suffix=".npz")
+        os.close(fd)
+        try:
+            if not storage.download_file(url, tmp_path):
+                with _misses_lock:
+                    _misses[content_hash] = time.monotonic() + INDEX_MISS_TTL
+                return None
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    try:
+        index = TemplateIndex.load(path)
+    except Exception as e:
+        print(f"Ignoring unreadable template index {path}: {e}")
+        return None
+    if index is None or index.det_size != tuple(det_size):
+        return None
+    return index
+
+
+def save_index(content_hash: str, index: TemplateIndex):
+    """
+    Saves the index locally and mirrors it to storage so other workers can reuse it.
+    """
+    import storage
+    path = os.path.join(INDEX_DIR, index_name(content_hash))
+    index.save(path)
+    with _misses_lock:
+        _misses.pop(content_hash, None)
+    storage.upload_file(path, INDEX_BUCKET, f"{INDEX_PREFIX}/{index_name(content_hash)}")
+    return path
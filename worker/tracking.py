@@ -0,0 +1,83 @@
+import cv2
+import numpy as np
+from insightface.app.common import Face
+
+
+class FaceTracker:
+    """
+    Runs the detector only on keyframes and carries the 5-point keypoints
+    forward with pyramidal Lucas-Kanade optical flow in between.
+
+    A full detection is forced every `interval` frames, on a scene cut, or
+    when the forward-backward flow check fails for too many keypoints.
+    """
+
+    def __init__(self, detect, interval=5, min_confidence=0.8, max_fb_error=1.5, scene_cut_threshold=0.4):
+        self.detect = detect
+        self.interval = max(1, int(interval))
+        self.min_confidence = min_confidence
+        self.max_fb_error = max_fb_error
+        self.scene_cut_threshold = scene_cut_threshold
+
+        self.prev_gray = None
+        self.prev_hist = None
+        self.faces = []
+        self.since_detect = 0
+
+        self.detections = 0
+        self.tracked = 0
+
+    def _histogram(self, gray):
+        small = cv2.resize(gray, (64, 36), interpolation=cv2.INTER_AREA)
+        hist = cv2.calcHist([small], [0], None, [32], [0, 256])
+        return cv2.normalize(hist, hist).flatten()
+
+    def _track(self, gray):
+        """
+        Returns the tracked faces, or None if tracking is not trustworthy.
+        """
+        if not self.faces:
+            return []
+
+        pts = np.concatenate([face.kps for face in self.faces]).astype(np.float32).reshape(-1, 1, 2)
+        lk_params = dict(winSize=(21, 21), maxLevel=3,
+                         criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03))
+        nxt, status, _ = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray, pts, None, **lk_params)
+        back, status_back, _ = cv2.calcOpticalFlowPyrLK(gray, self.prev_gray, nxt, None, **lk_params)
+        fb_error = np.linalg.norm((pts - back).reshape(-1, 2), axis=1)
+        good = (status.reshape(-1) == 1) & (status_back.reshape(-1) == 1) & (fb_error < self.max_fb_error)
+
+        nxt = nxt.reshape(-1, 5, 2)
+        good = good.reshape(-1, 5)
+        tracked = []
+        for face, kps, ok in zip(self.faces, nxt, good):
+            confidence = ok.mean()
+            if confidence < self.min_confidence:
+                return None
+            shift = (kps - face.kps).mean(axis=0)
+            bbox = np.asarray(face.bbox, dtype=np.float32) + np.tile(shift, 2)
+            tracked.append(Face(bbox=bbox, kps=kps, det_score=face.det_score * confidence))
+        return tracked
+
+    def update(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        hist = self._histogram(gray)
+
+        faces = None
+        if self.prev_gray is not None and self.since_detect < self.interval:
+            scene_cut = cv2.compareHist(self.prev_hist, hist, cv2.HISTCMP_BHATTACHARYYA) > self.scene_cut_threshold
+            if not scene_cut:
+                faces = self._track(gray)
+
+        if faces is None:
+            faces = self.detect(frame)
+            self.since_detect = 0
+            self.detections += 1
+        else:
+            self.tracked += 1
+        self.since_detect += 1
+
+        self.prev_gray = gray
+        self.prev_hist = hist
+        self.faces = faces
+        return faces